@@ -18,10 +18,22 @@ limitations under the License.
 
 from .fm_agent import FastmodelAgent
 from .fm_agent import SimulatorError
+from .fm_agent import GDB_ON_DEMAND
+from .session import ReplayAgent
+from .run_history import RunHistory
 
 def create(*args, **kwargs):
     ''' Simple class used to create FastmodelAgent objects
     @param All parameters passed from this function will go to FastmodelAgent ctor
     @return FastmodelAgent(*args, **kwargs) object instance
+    @details the instance is a (async) context manager, "with create(model, config) as sim:"
+        releases the terminal socket, IRIS connection, model process and ports on exit
     '''
     return FastmodelAgent(*args, **kwargs)
+
+def replay(*args, **kwargs):
+    ''' Simple class used to create ReplayAgent objects
+    @param All parameters passed from this function will go to ReplayAgent ctor
+    @return ReplayAgent(*args, **kwargs) object instance serving a session recorded with create(..., record=path)
+    '''
+    return ReplayAgent(*args, **kwargs)
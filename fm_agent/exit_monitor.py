@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+mbed SDK
+Copyright (c) 2011-2021 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import threading
+from concurrent.futures import Future
+
+# semihosting operations, see the Arm semihosting specification
+SYS_EXIT = 0x18
+SYS_EXIT_EXTENDED = 0x20
+ADP_STOPPED_APPLICATION_EXIT = 0x20026
+
+# symbols a program calls to terminate, exit code in r0, in order of preference:
+# _exit runs after the atexit handlers and the stdio flush, exit before them
+EXIT_SYMBOLS = ("_exit", "exit")
+
+def semihosting_exit_code(op, param, read_word):
+    """ decode the exit code of a semihosting exit call
+        @param op is r0 and param is r1 at the semihosting call
+        @param read_word reads a 32-bit word of target memory
+        @return None if the call is not an exit
+    """
+    if op == SYS_EXIT:
+        if param == ADP_STOPPED_APPLICATION_EXIT:
+            return 0
+        return param
+    if op == SYS_EXIT_EXTENDED:
+        if read_word(param) == ADP_STOPPED_APPLICATION_EXIT:
+            return read_word(param + 4)
+        return read_word(param)
+    return None
+
+class ExitMonitor():
+    """ Poll a running model in the background until the target program exits
+        @param check returns the exit code once the program has finished, None while it is running
+        exit_future is resolved with the exit code as soon as check reports it.
+    """
+    POLL_INTERVAL = 0.01
+
+    def __init__(self, check, interval=POLL_INTERVAL):
+        self.check = check
+        self.interval = interval
+        self.exit_future = Future()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ stop polling, must be called before the model is touched from another thread """
+        self._stop.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.exit_future.cancel()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                code = self.check()
+            except Exception as e:
+                self.exit_future.set_exception(e)
+                return
+            if code is not None:
+                self.exit_future.set_result(code)
+                return
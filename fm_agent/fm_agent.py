@@ -19,11 +19,44 @@ limitations under the License.
 import multiprocessing
 import sys
 import os
-from subprocess import Popen
+from subprocess import Popen, TimeoutExpired
 import time
+import threading
 import socket
+import asyncio
+import difflib
+from functools import partial
+try:
+    import fcntl
+except ImportError:
+    # no cross-process lock on Windows, allocators still check the host ports are free
+    fcntl = None
 from .utils import *
 from .fm_config import FastmodelConfig
+from .target_memory import TargetMemory, TargetStruct
+from .model_cache import ModelMetadataCache
+from .supervisor import ProcessSupervisor
+from .exit_monitor import ExitMonitor, EXIT_SYMBOLS, semihosting_exit_code
+from .profiler import SymbolIndex, PCSampler
+from .session import SessionRecorder
+from .run_history import RunHistory
+
+# layout of the ported gcov_var structure, see __gcov_var__ported
+GCOV_VAR = TargetStruct('gcov_var', [('start', 'I'), ('end', 'I'), ('filename', 'I')])
+
+# optional function a coverage image calls once __gcov_var__ported describes a complete gcda buffer,
+# when present the dump breakpoint sits on its entry instead of the returns of __gcov_close__ported
+COVERAGE_HOOK = "fm_agent_gcov_dump"
+
+# the window allowed to reach the next coverage breakpoint grows by this many times the slowest
+# interval seen so far, so images writing large gcda files get more time as the dump progresses
+COVERAGE_TIMEOUT_SCALE = 4
+
+# enable_gdbserver value to load the GDB plugin only when attach_debugger() is called
+GDB_ON_DEMAND = "on-demand"
+
+# thumb encoding of the semihosting trap "BKPT 0xAB"
+SEMIHOSTING_BKPT = 0xBEAB
 
 class _Port:
     '''Self-freeing port wrapper class.'''
@@ -41,13 +74,23 @@ class _Port:
 
 class _PortAllocator:
     '''Port allocator. Allocate ports in a range, wrapping around to reuse earlier free ports when the end of the range
-    is reached.'''
-    def __init__(self, range_start, range_end, skip=1):
+    is reached.
+    With lock_name, every allocated port also holds a lock file in get_cache_dir(), so agents in other processes on
+    the same host skip it. The lock goes with the process, lock files are left behind for the next allocation.
+    With bind, host ports another program is listening on are skipped (skip ports from each allocated one).'''
+
+    # lock file directory, inside get_cache_dir()
+    LOCK_DIR = "locks"
+
+    def __init__(self, range_start, range_end, skip=1, lock_name=None, bind=False):
         assert range_start + skip <= range_end
         self.range_start = range_start
         self.range_end = range_end
         self.skip = skip
+        self.lock_name = lock_name
+        self.bind = bind
         self.ports = set()
+        self.locks = {}
         self._last = range_start
 
     def allocate(self):
@@ -63,43 +106,135 @@ class _PortAllocator:
             port.freed = True
             port = port.value
         self.ports.remove(port)
+        lock = self.locks.pop(port, None)
+        if lock:
+            lock.close()
 
     def _allocate(self, start):
         for port in range(start, self.range_end, self.skip):
             if port in self.ports:
                 continue
+            lock = self._reserve(port)
+            if lock is False:
+                continue
+            if lock:
+                self.locks[port] = lock
             self.ports.add(port)
             self._last = port
             return _Port(port, self)
         raise OverflowError()
 
+    def _reserve(self, port):
+        '''Reserve a port against other processes. Return the held lock file (None if there is nothing to hold), False
+        if the port is in use.'''
+        lock = None
+        if self.lock_name and fcntl:
+            lock_dir = os.path.join(get_cache_dir(), self.LOCK_DIR, socket.gethostname())
+            try:
+                os.makedirs(lock_dir, exist_ok=True)
+                lock = open(os.path.join(lock_dir, self.lock_name(port) + ".lock"), "a")
+            except OSError:
+                # no cache directory, the port is only reserved within this process
+                lock = None
+            else:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    lock.close()
+                    return False
+        if self.bind and not all(_host_port_free(p) for p in range(port, port + self.skip)):
+            if lock:
+                lock.close()
+            return False
+        return lock
+
+def _host_port_free(port):
+    '''Return if nothing listens on a host port.'''
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        if ON_POSIX:
+            # ports in TIME_WAIT can be listened on again
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind(('', port))
+        except OSError:
+            return False
+    return True
+
+def _host_port_lock(port):
+    return "port-%d" % port
+
 class FastmodelAgent():
     _setup_lock = multiprocessing.Lock()
-    _gdb_port_allocator = _PortAllocator(31627, 65535)
-    _telnet_port_allocator = _PortAllocator(5000, 7000, skip=4)
-
-    def __init__(self, model_name=None, model_config=None, logger=None, enable_gdbserver=False):
+    _gdb_port_allocator = _PortAllocator(31627, 65535, lock_name=_host_port_lock, bind=True)
+    _telnet_port_allocator = _PortAllocator(5000, 7000, skip=4, lock_name=_host_port_lock, bind=True)
+    _net_port_allocator = _PortAllocator(20000, 31000, lock_name=_host_port_lock, bind=True)
+    _tap_allocators = {}
+    _supervisor = ProcessSupervisor()
+
+    def __init__(self, model_name=None, model_config=None, logger=None, enable_gdbserver=False, enable_iris=None,
+                 detect_exit=None, record=None, run_history=None):
         """ initialize FastmodelAgent
             @param all are optional, if none of the argument give, will just query for information
             @param if want to launch and connect to fast model, model_name and model_config are necessary
             @param model_name is the name to the fast model
             @param model_config is the config file to the fast model
+            @param enable_gdbserver True to always load the GDB plugin, GDB_ON_DEMAND to load it
+                   only when attach_debugger() is called
+            @param enable_iris set to False for a terminal only model: no IRIS server, the image is
+                   passed on the command line and the model is launched by run_simulator
+            @param detect_exit set to True to watch for the target program exit (_exit, or exit, breakpoint
+                   or semihosting exit), see exit_future and add_exit_callback
+            @param record is a file to record terminal traffic and lifecycle events to, for ReplayAgent
+            @param run_history is a RunHistory, or the path of its database, to store the phase durations
+                   of every run in
+            @param enable_iris, detect_exit, record and run_history default to the "enable_iris", "detect_exit",
+                   "record" and "run_history" keys of the model in settings.json, then of COMMON
         """
 
         self.fastmodel_name = model_name
         self.config_name    = model_config
         self.enable_gdbserver = enable_gdbserver
+        self.agent_args = {"enable_iris": enable_iris, "detect_exit": detect_exit,
+                           "record": record, "run_history": run_history} # None: read from settings.json on setup
+        self.enable_iris = enable_iris is not False
+        self.started = False # terminal only model accepted start_simulator
+        self.detect_exit = bool(detect_exit)
+        self.exit_monitor = None
+        self.exit_addrs = set() # exit breakpoints of the loaded image
+        self.debugger_requested = False # the program failed with enable_gdbserver=GDB_ON_DEMAND
+        self._exit_callbacks = []
         self.subprocess = None
+        self.gdb_port = None
+        self.telnet_port = None
+        self.net_ports = {} # guest port: host port forwarded with user mode networking
+        self.tap_index = None
+        self.tap_interface = None
 
         #If logging not provided, use default log
         if logger:
-            self.logger = logger
+            self.logger = printf_logger(logger)
         else:
             self.logger = FMLogger('fm_agent')
 
         self.read_timeout = 0.2
+        self.connect_timeout = 10
+        self.coverage_timeout = 15 # minimum seconds allowed between two coverage breakpoints
+        self.coverage_hook = COVERAGE_HOOK
+        self.coverage_breakpoints = None # (gcov_var address, dump addresses, exit addresses)
+        self.coverage_dumps = []
+        self.profiler = None
+        self.profile_dir = "BUILD"
         self.model = None # running instant of the model
+        self.cpus = [] # cached cpu targets of the running model
+        self.terminal = None # cached terminal target of the running model
+        self.iris_lock = threading.RLock() # serialises IRIS calls of the background monitors
+        self.metadata_cache = ModelMetadataCache()
         self.socket = None # running instant of socket
+        self.traffic = TrafficRing() # recent terminal traffic, dumped on failure
+        self.recorder = SessionRecorder(record) if record else None
+        self.run_history = self.__open_run_history(run_history)
+        self.phase_times = {} # seconds spent in launch, load, run and shutdown
+        self._run_start = None
         self.configuration = FastmodelConfig()
 
         if model_config:
@@ -109,8 +244,23 @@ class FastmodelAgent():
 
     def __del__(self):
         if isinstance(self.subprocess, Popen):
-            self.subprocess.terminate()
-            self.subprocess.wait()
+            self._supervisor.stop(self.subprocess)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self.dump_terminal_traffic()
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self.dump_terminal_traffic()
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
 
     def setup_simulator(self, model_name, model_config):
         """ setup the simulator, this is crucial before you can start a simulator.
@@ -120,8 +270,33 @@ class FastmodelAgent():
         """
         with self._setup_lock:
             self._internal_setup_simulator(model_name, model_config)
+        self.__record("setup", {"model": model_name, "config": model_config})
+
+    def __record(self, ev, data=None):
+        if self.recorder:
+            self.recorder.event(ev, data)
+
+    def __open_run_history(self, run_history):
+        if run_history and not isinstance(run_history, RunHistory):
+            run_history = RunHistory(run_history)
+        return run_history
+
+    def __apply_settings(self):
+        """ take the behaviour not given to the constructor from settings.json """
+        args = self.agent_args
+        if args["enable_iris"] is None:
+            self.enable_iris = bool(self.configuration.get_enable_iris(self.fastmodel_name))
+        if args["detect_exit"] is None:
+            self.detect_exit = bool(self.configuration.get_detect_exit(self.fastmodel_name))
+        if args["record"] is None and not self.recorder:
+            record = self.configuration.get_record(self.fastmodel_name)
+            self.recorder = SessionRecorder(record) if record else None
+        if args["run_history"] is None and not self.run_history:
+            self.run_history = self.__open_run_history(self.configuration.get_run_history(self.fastmodel_name))
 
     def _internal_setup_simulator(self, model_name, model_config):
+        # a new setup allocates its own ports, e.g. mbedfm --self-test sets up every model in turn
+        self.__free_ports()
         self.fastmodel_name = model_name
         self.config_name    = model_config
 
@@ -132,28 +307,26 @@ class FastmodelAgent():
         self.model_binary = self.configuration.get_model_binary(self.fastmodel_name)
 
         if not self.model_binary:
-            self.logger.prn_err("NO model_binary available for '%s'"% self.fastmodel_name)
+            self.logger.prn_err("NO model_binary available for '%s'", self.fastmodel_name)
             self.__guide()
             raise SimulatorError("fastmodel '%s' not available" % (self.fastmodel_name))
 
-        self.model_options = self.configuration.get_model_options(self.fastmodel_name)
+        self.__apply_settings()
+
+        self.model_options = list(self.configuration.get_model_options(self.fastmodel_name))
+        self.metadata_key_options = list(self.model_options)
 
         self.telnet_port = self._telnet_port_allocator.allocate()
 
+        self.telnet_options = []
         if self.config_name == "MPS2":
-            self.model_options += ['-C', f'fvp_mps2.telnetterminal0.start_port={self.telnet_port.value}']
+            self.telnet_options = ['-C', f'fvp_mps2.telnetterminal0.start_port={self.telnet_port.value}']
         elif self.config_name == "MPS3":
-            self.model_options += ['-C', f'mps3_board.telnetterminal0.start_port={self.telnet_port.value}']
-
-        if self.enable_gdbserver:
-            self.gdb_port = self._gdb_port_allocator.allocate()
-            self.model_options += [
-                '--allow-debug-plugin',
-                '--plugin',
-                'GDBRemoteConnection.so',
-                '-C',
-                f'REMOTE_CONNECTION.GDBRemoteConnection.port={self.gdb_port.value}'
-            ]
+            self.telnet_options = ['-C', f'mps3_board.telnetterminal0.start_port={self.telnet_port.value}']
+        self.model_options += self.telnet_options
+
+        if self.enable_gdbserver and self.enable_gdbserver != GDB_ON_DEMAND:
+            self.__add_gdbserver()
 
         config_dict = self.configuration.get_configs(self.fastmodel_name)
 
@@ -167,46 +340,235 @@ class FastmodelAgent():
             self.__guide()
             raise SimulatorError("No config %s avaliable for fastmodel %s" % (self.config_name,self.fastmodel_name))
 
+        self.__setup_network()
+
         self.model_terminal = self.configuration.get_model_terminal_comp(self.fastmodel_name)
 
         if not self.model_terminal:
-            self.logger.prn_err("NO terminal_compoment defined for '%s'"% self.fastmodel_name)
+            self.logger.prn_err("NO terminal_compoment defined for '%s'", self.fastmodel_name)
             raise SimulatorError("fastmodel '%s' not defined terminal compoment" % (self.fastmodel_name))
 
+        if self.config_name == "COVERAGE" and not self.enable_iris:
+            raise SimulatorError("config COVERAGE requires IRIS, enable_iris must be set")
+
+        if os.path.exists(self.model_binary):
+            self.__validate_config()
+
+    def __validate_config(self):
+        """ check the config file and -C options against the parameters of the model binary
+            The parameter list is queried once per model binary build and cached on disk.
+        """
+        key = self.metadata_cache.key(self.model_binary)
+        params = self.metadata_cache.get(key, "params")
+        if params is None:
+            params = list_model_params(self.model_binary)
+            if params is None:
+                return
+            self.metadata_cache.set(key, "params", params)
+        known = set(params)
+
+        # plugin parameters are not listed by the model, only check the options for the model itself
+        to_check = [("%s:%d" % (self.model_config_file, lineno), name)
+                    for lineno, name in read_config_params(self.model_config_file)]
+        to_check += [("-C option", name) for name in option_params(self.metadata_key_options + self.telnet_options +
+                                                                    self.network_options)]
+
+        errors = []
+        for where, name in to_check:
+            if name not in known:
+                error = "%s: unknown parameter '%s'" % (where, name)
+                close = difflib.get_close_matches(name, params, n=1)
+                if close:
+                    error += ", did you mean '%s'?" % close[0]
+                errors.append(error)
+
+        if errors:
+            for error in errors:
+                self.logger.prn_err(error)
+            raise SimulatorError("Invalid parameters for fastmodel %s: %s" % (self.fastmodel_name, "; ".join(errors)))
+
+    def __setup_network(self):
+        """ give this instance its own networking resources, so several models can run side by side
+            User mode networking gets host ports from _net_port_allocator for every guest port listed in
+            "user_net_ports". TAP networking gets one free interface of "tap_interfaces" in settings.json.
+            Both are reserved against agents in other processes too, see _PortAllocator.
+        """
+        self.network_options = []
+        hostbridge = {}
+        values = read_config_values(self.model_config_file)
+        values.update(value.split('=', 1) for option, value in zip(self.model_options, self.model_options[1:])
+                      if option == '-C' and '=' in value)
+        for name, value in values.items():
+            prefix, _, param = name.rpartition('.hostbridge.')
+            if prefix:
+                hostbridge[param] = (prefix.strip(), value.strip())
+
+        if 'userNetworking' in hostbridge and hostbridge['userNetworking'][1].lower() not in ('0', 'false'):
+            guest_ports = self.configuration.get_user_net_ports(self.fastmodel_name)
+            for guest_port in guest_ports:
+                self.net_ports[guest_port] = self._net_port_allocator.allocate()
+            if self.net_ports:
+                forwards = ",".join("%d=%d" % (host.value, guest) for guest, host in self.net_ports.items())
+                self.network_options += ['-C', f'{hostbridge["userNetworking"][0]}.hostbridge.userNetPorts={forwards}']
+
+        if 'interfaceName' in hostbridge:
+            interfaces = self.configuration.get_tap_interfaces(self.fastmodel_name)
+            if interfaces:
+                allocator = self._tap_allocators.get(tuple(interfaces))
+                if not allocator:
+                    allocator = self._tap_allocators[tuple(interfaces)] = _PortAllocator(
+                        0, len(interfaces), lock_name=lambda index, interfaces=interfaces: "tap-%s" % interfaces[index])
+                try:
+                    self.tap_index = allocator.allocate()
+                except OverflowError:
+                    raise SimulatorError("All tap interfaces %s are in use" % ", ".join(interfaces))
+                self.tap_interface = interfaces[self.tap_index.value]
+                self.network_options += ['-C', f'{hostbridge["interfaceName"][0]}.hostbridge.interfaceName={self.tap_interface}']
+
+        self.model_options += self.network_options
+
+    def __add_gdbserver(self):
+        """ reserve a gdb port and load the GDB plugin on the next launch """
+        self.gdb_port = self._gdb_port_allocator.allocate()
+        self.model_options += [
+            '--allow-debug-plugin',
+            '--plugin',
+            'GDBRemoteConnection.so',
+            '-C',
+            f'REMOTE_CONNECTION.GDBRemoteConnection.port={self.gdb_port.value}'
+        ]
+
+    def attach_debugger(self):
+        """ relaunch the model with the GDB plugin loaded, rerunning the loaded image from reset
+            Used with enable_gdbserver=GDB_ON_DEMAND, so only runs that need a debugger pay for the
+            plugin and a gdb port. With detect_exit set, a non-zero exit code sets debugger_requested;
+            the thread driving the agent may then call attach_debugger(), the rerun halts on the same
+            exit breakpoint for GDB. Never call it from an exit callback, it relaunches the model.
+            The model state is not preserved: the plugin can only be loaded at launch, and IRIS
+            checkpoints are not supported by the MPS2/MPS3 FVPs, so the image restarts from reset.
+            @return the gdb port, None if the model is not running
+        """
+        if not self.is_simulator_alive():
+            self.logger.prn_err("Fast Model not running, cannot attach debugger")
+            return None
+        if self.gdb_port is None:
+            self.__add_gdbserver()
+            self.logger.prn_wrn("Relaunching FastModel with GDB server on port %d", self.gdb_port.value)
+            if not self.reset_simulator():
+                return None
+            self.logger.prn_wrn("GDB server listening on port %d", self.gdb_port.value)
+        self.debugger_requested = False
+        return self.gdb_port.value
+
     def __connect_terminal(self):
         """ connect socket terminal to a launched fastmodel"""
         self.logger.prn_inf("Establishing socket connection to FastModel Terminal")
-        time.sleep(2)
-        try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.connect((self.host, self.port))
-            self.socket.settimeout(self.read_timeout)
-        except socket.error as e:
-            self.socket = None
-            self.logger.prn_err("Socket connection error, socket.connect(%s, %s)" % (self.host, self.port))
-            self.logger.prn_err("Error: %s" % str(e))
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                self.socket = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+                self.socket.settimeout(self.read_timeout)
+                return
+            except socket.error as e:
+                self.socket = None
+                if time.monotonic() >= deadline:
+                    self.logger.prn_err("Socket connection error, socket.connect(%s, %s)", self.host, self.port)
+                    self.logger.prn_err("Error: %s", e)
+                    return
+                # terminal server not listening yet, retry shortly
+                time.sleep(0.05)
 
     def __guide(self):
         """ print out information mebdls, help user to spot where possible went wrong"""
         self.logger.prn_inf("Use 'mbedfm' to list all the available Fast Models")
 
+    def __launch_model(self):
+        """ launch the model binary under the process supervisor """
+        launch_start = time.monotonic()
+        self._supervisor.reap_orphans()
+        if self.enable_iris:
+            self.subprocess, self.IRIS_port, self.launch_output = launch_FVP_IRIS(
+                self.model_binary, self.model_config_file, self.model_options, self._supervisor.popen_kwargs(),
+                logger=self.logger)
+        else:
+            self.subprocess, self.port, self.launch_output = launch_FVP_terminal(
+                self.model_binary, self.model_config_file, self.model_options, self.image,
+                self.model_terminal.split('.')[-1], self._supervisor.popen_kwargs(), logger=self.logger)
+        self._supervisor.register(self.subprocess, self.model_binary,
+                                  [self.telnet_port, self.gdb_port] + list(self.net_ports.values()))
+        self.phase_times['launch'] = self.phase_times.get('launch', 0.0) + time.monotonic() - launch_start
+
+    def __launch_terminal_only(self):
+        """ launch a terminal only model running the loaded image and connect its terminal """
+        self.__launch_model()
+        if not self.port:
+            print(self.launch_output)
+            self.logger.prn_err("Fast Model terminal did not start listening")
+            self._supervisor.stop(self.subprocess)
+            return False
+        # the image runs from launch, the launch itself is timed by __launch_model
+        self._run_start = time.monotonic()
+        self.__connect_terminal()
+        return True
+
+    def __connect_model(self, IRIS_port):
+        """ connect to the IRIS server of a launched fastmodel and look up its targets once
+            The cpu instance names are static for a model binary and config, so they are cached
+            on disk and resolved directly by name on later launches instead of enumerating targets.
+        """
+        import iris.debug
+        self.model = iris.debug.NetworkModel('localhost',IRIS_port)
+
+        key = self.metadata_cache.key(self.model_binary, self.model_config_file, self.metadata_key_options)
+        cpu_names = self.metadata_cache.get(key, "cpus")
+        self.cpus = []
+        if cpu_names:
+            try:
+                self.cpus = [self.model.get_target(name) for name in cpu_names]
+            except Exception:
+                self.logger.prn_wrn("Cached cpu list of %s is stale, querying model", self.fastmodel_name)
+                self.cpus = []
+        if not self.cpus:
+            self.cpus = self.model.get_cpus()
+            self.metadata_cache.set(key, "cpus", [cpu.instName for cpu in self.cpus])
+
+        # check which host socket port is used for terminal0, this may change on every launch
+        self.terminal = self.model.get_target(self.model_terminal)
+        self.port = self.terminal.read_register('Default.Port')
+
     def is_simulator_alive(self):
-        """return if the terminal socket is connected"""
+        """return if the terminal socket is connected
+            a terminal only model is alive once started, until its process exits
+        """
+        if not self.enable_iris:
+            return self.started and (self.subprocess is None or self.subprocess.poll() is None)
         return bool(self.model)
 
     def start_simulator(self, stream=sys.stdout):
-        """ launch given fastmodel with configs """
+        """ launch given fastmodel with configs
+            a terminal only model is not launched until run_simulator, once the image is known
+        """
+        self.phase_times = {}
+        self._run_start = None
+        self.debugger_requested = False
+        if not self.enable_iris:
+            if isinstance(self.subprocess, Popen):
+                # the model of a previous start is not reused, it is launched again by run_simulator
+                self._supervisor.stop(self.subprocess)
+            self.subprocess = None
+            self.host = "localhost"
+            self.image = None
+            self.started = True
+            self.__record("start")
+            return True
         if check_import(self.fastmodel_name):
-            import iris.debug
-            self.subprocess, IRIS_port, outs = launch_FVP_IRIS(self.model_binary, self.model_config_file, self.model_options)
+            self.__launch_model()
             if stream:
-                print(outs, file=stream)
-            self.model = iris.debug.NetworkModel('localhost',IRIS_port)
-            # check which host socket port is used for terminal0
-            terminal = self.model.get_target(self.model_terminal)
-            self.port = terminal.read_register('Default.Port')
+                print(self.launch_output, file=stream)
+            self.__connect_model(self.IRIS_port)
             self.host = "localhost"
             self.image = None
+            self.__record("start")
 
             return True
         else:
@@ -215,66 +577,238 @@ class FastmodelAgent():
     def load_simulator(self,image):
         """ Load a launched fastmodel with given image(full path)"""
         if self.is_simulator_alive():
-            cpu = self.model.get_cpus()[0]
+            load_start = time.monotonic()
             app = os.path.normpath(image)
             if os.path.exists(app):
-                cpu.load_application(app)
+                if self.enable_iris:
+                    self.cpus[0].load_application(app)
+                self.phase_times['load'] = time.monotonic() - load_start
                 self.image = os.path.normpath(app)
+                self.__record("load", self.image)
             else:
-                self.logger.prn_err("Image %s not exist while loading to Fast Models" % app)
+                self.logger.prn_err("Image %s not exist while loading to Fast Models", app)
                 return False
             return True
         else:
             return False
 
-    def run_simulator(self):
-        """ Start running a launched fastmodel and connect terminal """
+    def run_simulator(self, profile_rate=None):
+        """ Start running a launched fastmodel and connect terminal
+            @param profile_rate when set, sample the pc of every cpu this many times per second
+                   and write a flat and a collapsed stack profile to profile_dir on shutdown.
+                   IRIS models only, sampling carries on across reset_simulator
+        """
+        if not self.enable_iris:
+            if not self.started:
+                return False
+            self.__record("run")
+            if isinstance(self.subprocess, Popen) and self.subprocess.poll() is None:
+                self.logger.prn_err("Fast Model already in running state")
+                return True
+            if profile_rate:
+                self.logger.prn_wrn("Profiling requires IRIS, profile_rate ignored with enable_iris=False")
+            return self.__launch_terminal_only() and self.__start_exit_monitor()
         if self.is_simulator_alive():
-            cpu = self.model.get_cpus()[0]
+            self.__record("run")
+            cpu = self.cpus[0]
             if cpu.is_running:
                 self.logger.prn_err("Fast Model already in running state")
             else:
+                if self.config_name == "COVERAGE" and not self.__resolve_coverage():
+                    return False
+                self.__set_exit_breakpoints()
+                self._run_start = time.monotonic()
                 self.model.run(blocking=False)
+                self.__start_exit_monitor()
+                if profile_rate:
+                    self.__start_profiler(profile_rate)
             self.__connect_terminal()
             return True
         else:
             return False
 
+    def __stop_run_clock(self):
+        """ add the time since the image started running to the run phase
+            The relaunch of a reset is timed as launch, so the run clock stops for it.
+        """
+        if self._run_start is not None:
+            self.phase_times['run'] = self.phase_times.get('run', 0.0) + time.monotonic() - self._run_start
+            self._run_start = None
+
     def reset_simulator(self):
-        """ reset a launched fastmodel and connect terminal """
-        if self.is_simulator_alive():
+        """ reset a launched fastmodel and connect terminal
+            a terminal only model is launched again even if its process already exited
+        """
+        if self.is_simulator_alive() or self.started:
             self.logger.prn_wrn("STOP and RESTART FastModel")
+            self.__record("reset")
+            self.__stop_run_clock()
+            self.__stop_exit_monitor()
+            if self.profiler:
+                # keep the samples taken so far, sampling resumes once the model runs again
+                self.profiler.stop()
             self.__closeConnection()
+            if not self.enable_iris:
+                self._supervisor.stop(self.subprocess)
+                return self.__launch_terminal_only() and self.__start_exit_monitor()
             self.model.release(shutdown=True)
-            time.sleep(1)
-            import iris.debug
+            self._supervisor.stop(self.subprocess, grace=1)
 
-            self.subprocess, IRIS_port, outs = launch_FVP_IRIS(self.model_binary, self.model_config_file)
-            if IRIS_port==0:
-                print(outs)
+            self.__launch_model()
+            if self.IRIS_port==0:
+                print(self.launch_output)
                 return False
-            self.model = iris.debug.NetworkModel('localhost',IRIS_port)
-            # check which host socket port is used for terminal0
-            terminal = self.model.get_target(self.model_terminal)
-            self.port = terminal.read_register('Default.Port')
-            cpu = self.model.get_cpus()[0]
+            self.__connect_model(self.IRIS_port)
+            cpu = self.cpus[0]
             if self.image:
                 cpu.load_application(self.image)
                 self.logger.prn_wrn("RELOAD new image to FastModel")
+            self.__set_exit_breakpoints()
+            self._run_start = time.monotonic()
             self.model.run(blocking=False)
+            self.__start_exit_monitor()
+            if self.profiler:
+                self.profiler.start(self.cpus)
             self.__connect_terminal()
             self.logger.prn_wrn("Reconnect Terminal")
             return True
         else:
             return False
 
+    def __start_profiler(self, rate):
+        if not self.image:
+            self.logger.prn_wrn("No image loaded, profiling disabled")
+            return
+        try:
+            index = SymbolIndex(read_symbol(self.image))
+        except SimulatorError as e:
+            self.logger.prn_wrn("%s, profiling disabled", e)
+            return
+        self.logger.prn_inf("Profiling %s at %d samples per second", self.image, rate)
+        self.profiler = PCSampler(self.cpus, index, rate, self.iris_lock).start()
+
+    def __stop_profiler(self):
+        """ stop sampling and write the profiles """
+        if not self.profiler:
+            return
+        self.profiler.stop()
+        os.makedirs(self.profile_dir, exist_ok=True)
+        files = self.profiler.write(os.path.join(self.profile_dir, os.path.basename(self.image)))
+        self.logger.prn_inf("Profile written to %s", ", ".join(files))
+        self.profiler = None
+
+    @property
+    def exit_future(self):
+        """ concurrent.futures.Future resolved with the target exit code, None unless detect_exit is set """
+        if self.exit_monitor:
+            return self.exit_monitor.exit_future
+        return None
+
+    def add_exit_callback(self, callback):
+        """ call callback(exit_code) when the target program exits, for this and later runs """
+        self._exit_callbacks.append(callback)
+        if self.exit_monitor:
+            self.exit_monitor.exit_future.add_done_callback(partial(self.__on_exit, callback))
+
+    def __on_exit(self, callback, future):
+        if not future.cancelled() and future.exception() is None:
+            callback(future.result())
+
+    def __start_exit_monitor(self):
+        """ start watching for the target exit, once the model runs """
+        if not self.detect_exit or self.config_name == "COVERAGE":
+            return True
+        if self.enable_iris:
+            check = partial(self.__iris_exit_code, self.cpus[0])
+        else:
+            check = self.subprocess.poll
+        self.exit_monitor = ExitMonitor(check)
+        self.exit_monitor.exit_future.add_done_callback(self.__log_exit)
+        for callback in self._exit_callbacks:
+            self.exit_monitor.exit_future.add_done_callback(partial(self.__on_exit, callback))
+        self.exit_monitor.start()
+        return True
+
+    def __stop_exit_monitor(self):
+        if self.exit_monitor:
+            self.exit_monitor.stop()
+
+    def __log_exit(self, future):
+        if not future.cancelled() and future.exception() is None:
+            self.logger.prn_inf("Target program exited with code %s", future.result())
+            self.__record("exit", future.result())
+            if future.result():
+                self.dump_terminal_traffic()
+                if self.enable_gdbserver == GDB_ON_DEMAND and self.gdb_port is None:
+                    # runs in the ExitMonitor thread, leave the relaunch to the thread driving the agent
+                    self.debugger_requested = True
+                    self.logger.prn_wrn("Call attach_debugger() to rerun the failed program with a GDB server")
+
+    def __set_exit_breakpoints(self):
+        """ break on the first exit function of EXIT_SYMBOLS found in the loaded image, before the model runs
+            Without symbols only semihosting exits and the end of the model process are detected.
+        """
+        self.exit_addrs = set()
+        if not self.detect_exit or self.config_name == "COVERAGE" or not self.image:
+            return
+        try:
+            symbol_table = read_symbol(self.image)
+        except SimulatorError as e:
+            self.logger.prn_wrn("%s, exit breakpoints disabled", e)
+            return
+        for symbol_name in EXIT_SYMBOLS:
+            symbol_range = get_symbol_range(symbol_table, symbol_name)
+            if symbol_range:
+                self.cpus[0].add_bpt_prog(symbol_range[0])
+                self.exit_addrs.add(symbol_range[0])
+                return
+
+    def __iris_exit_code(self, cpu):
+        """ check for a finished program, runs in the ExitMonitor thread
+            A semihosting exit may terminate the model process itself, its return code is the exit code then.
+            @return the exit code, None while the program runs or stopped elsewhere
+        """
+        code = self.subprocess.poll()
+        if code is not None:
+            return code
+        with self.iris_lock:
+            try:
+                return self.__halted_exit_code(cpu)
+            except Exception:
+                # IRIS goes away with an exiting model
+                try:
+                    return self.subprocess.wait(1)
+                except TimeoutExpired:
+                    pass
+                raise
+
+    def __halted_exit_code(self, cpu):
+        """ check a halted cpu for an exit breakpoint or a semihosting exit call """
+        if cpu.is_running:
+            return None
+        pc = cpu.read_register('Core.R15')
+        op = cpu.read_register('Core.R0')
+        if pc in self.exit_addrs:
+            return op
+        memory = TargetMemory(cpu)
+        # the pc is on or just after the BKPT depending on the model, read both halfwords at once
+        halfwords = memory.read_batch([(pc, 2), (pc - 2, 2)], max_gap=0)
+        if SEMIHOSTING_BKPT in (int.from_bytes(halfword, 'little') for halfword in halfwords):
+            return semihosting_exit_code(op, cpu.read_register('Core.R1'), memory.read_u32)
+        return None
+
     def read(self, end='\n', bs=-1):
+        """ read from the terminal socket until end, bs bytes or read_timeout without data
+            @param end is a str or bytes terminator, included in the returned data, None to read until timeout
+            @return the received bytes, None if the terminal is not connected
+        """
 
         if not self.__socketConnected():
             return None
 
         if bs is None:
             bs = -1
+        end = end.encode() if isinstance(end, str) else end or b''
 
         data = bytearray()
         read_stop = False
@@ -289,13 +823,23 @@ class FastmodelAgent():
                 self.socket = None
                 self.logger.prn_err("Fastmodel Read connection lost, socket.recv()")
                 self.logger.prn_err(str(e))
+                self.traffic.append('RXD', data)
+                self.__record_traffic('rx', data)
+                self.dump_terminal_traffic()
+                return data
             else:
                 data += char
-                if char == end or (bs >= 0 and len(data) >= bs):
+                if (end and data.endswith(end)) or (bs >= 0 and len(data) >= bs):
                     read_stop=True
 
+        self.traffic.append('RXD', data)
+        self.__record_traffic('rx', data)
         return data
 
+    def __record_traffic(self, direction, data):
+        if self.recorder:
+            self.recorder.traffic(direction, data)
+
     def write(self, payload, log=False):
         """! Write payload to terminal socket
             @details due to the characteristic of fastmodel terminal socket.
@@ -311,15 +855,24 @@ class FastmodelAgent():
             for char in payload:
                 self.socket.sendall(char.encode())
                 time.sleep(0.01)
+            self.traffic.append('TXD', payload.encode())
+            self.__record_traffic('tx', payload.encode())
             if log:
                 self.logger.prn_txd(payload)
             return True
         except socket.error as e:
             self.socket = None
-            self.logger.prn_err("Fastmodel Write connection lost, socket.write(%s)" % payload )
+            self.logger.prn_err("Fastmodel Write connection lost, socket.write(%s)", payload)
             self.logger.prn_err(str(e))
+            self.dump_terminal_traffic()
             return False
 
+    def dump_terminal_traffic(self):
+        """ log the most recent terminal traffic kept in the ring and clear it """
+        if self.traffic.size:
+            self.logger.prn_wrn("Last %d bytes of terminal traffic:", self.traffic.size)
+            self.traffic.dump(self.logger)
+
     def __socketConnected(self):
         """return whether the socket serial is connected"""
         return bool(self.socket)
@@ -333,98 +886,189 @@ class FastmodelAgent():
         else:
             self.logger.prn_inf("Terminal socket connection already closed")
 
-    def __run_to_breakpoint(self):
+    def __run_to_breakpoint(self, timeout):
+        """ run until a breakpoint is hit
+            @return False if no breakpoint is hit within timeout seconds, the model is stopped then
+        """
         try:
-            self.model.run(timeout=15)
-        except:
+            self.model.run(timeout=timeout)
+        except Exception:
             # On timeout, model hangs
-            self.logger.prn_err("ERROR: Timeout reached without stop at breakpoint")
+            self.logger.prn_err("ERROR: No breakpoint reached for %.1f seconds", timeout)
             self.model.stop()
             return False
         else:
             return True
 
-    def __CodeCoverage(self):
-        """ runs code coverage dump gcda file """
-
-        self.model.stop()
-        cpu = self.model.get_cpus()[0]
-
-        symbol_table = []
-        self.logger.prn_inf("Reading symbols from %s" % self.image)
-        if self.image:
+    def __exit_addrs(self, symbol_table, symbol_name):
+        """ find the return and tail call instructions of a function from the image
+            @return the set of their addresses
+        """
+        symbol_range = get_symbol_range(symbol_table, symbol_name)
+        if not symbol_range:
+            raise SimulatorError("Symbol [%s] not found in %s" % (symbol_name, self.image))
+        addresses = set(get_return_addrs(self.image, *symbol_range))
+        if not addresses:
+            raise SimulatorError("No return instruction found in [%s], is arm-none-eabi-objdump in PATH?" % symbol_name)
+        return addresses
+
+    def __resolve_coverage(self):
+        """ find the coverage breakpoint addresses in the loaded image, before the model runs
+            A missing symbol, arm-none-eabi-readelf or arm-none-eabi-objdump is reported by run_simulator,
+            not at shutdown.
+            @return False if coverage cannot be collected from the image
+        """
+        self.coverage_breakpoints = None
+        if not self.image:
+            self.logger.prn_err("No image loaded, cannot collect coverage")
+            return False
+        try:
             symbol_table = read_symbol(self.image)
+            data_hex_addr = get_symbol_addr(symbol_table, "__gcov_var__ported")
+            if not data_hex_addr:
+                raise SimulatorError("Symbol [__gcov_var__ported] not found in %s" % self.image)
+            hook_range = get_symbol_range(symbol_table, self.coverage_hook)
+            if hook_range:
+                dump_addrs = {hook_range[0]}
+            else:
+                dump_addrs = self.__exit_addrs(symbol_table, "__gcov_close__ported")
+            exit_addrs = self.__exit_addrs(symbol_table, "collect_coverage")
+        except SimulatorError as e:
+            self.logger.prn_err(str(e))
+            return False
+        self.logger.prn_inf("Address for [__gcov_var__ported] is %s", data_hex_addr)
+        self.coverage_breakpoints = (HexToInt(data_hex_addr), dump_addrs, exit_addrs)
+        return True
 
-        data_hex_addr = get_symbol_addr(symbol_table, "__gcov_var__ported")
-        data_int_addr = HexToInt(data_hex_addr)
-        self.logger.prn_inf("Address for [__gcov_var__ported] is %s" % data_hex_addr )
-
-        dump_hex_addr = get_symbol_addr(symbol_table, "__gcov_close__ported")
-        dump_int_addr = HexToInt(dump_hex_addr)
-        self.logger.prn_inf("Address for [__gcov_close__ported] is %s" % dump_hex_addr )
-
-        exit_hex_addr = get_symbol_addr(symbol_table, "collect_coverage")
-        exit_int_addr = HexToInt(exit_hex_addr)
-        self.logger.prn_inf("Address for [collect_coverage] is %s" % exit_hex_addr )
-
+    def __CodeCoverage(self):
+        """ runs code coverage dump gcda file
+            The dump breakpoints sit on the entry of coverage_hook if the image defines it, else on the
+            return instructions of __gcov_close__ported: the port fills __gcov_var__ported with the gcda
+            buffer before closing the file and only clears it on the next open, so it still describes
+            the buffer on return (the original fixed breakpoint at __gcov_close__ported+57 was that
+            return). The exit breakpoints sit on the returns of collect_coverage, where the dump is complete.
+            @return a list of (gcda file name, dump duration in seconds)
+        """
 
+        self.model.stop()
+        if not self.coverage_breakpoints:
+            raise SimulatorError("Coverage breakpoints of %s not resolved, no coverage collected" % self.image)
+        cpu = self.cpus[0]
+        memory = TargetMemory(cpu)
+        data_int_addr, dump_addrs, exit_addrs = self.coverage_breakpoints
 
         self.logger.prn_inf("Setting breakpoints...")
-        bkpt_dump = cpu.add_bpt_prog( dump_int_addr + 57 )
-        bkpt_exit  = cpu.add_bpt_prog( exit_int_addr + 43 )
+        for address in sorted(dump_addrs | exit_addrs):
+            cpu.add_bpt_prog(address)
 
         self.logger.prn_inf("Removing old gcda files...")
         remove_gcda()
 
-        self.__run_to_breakpoint()
-        stopped_loc = cpu.read_register('Core.R15')
-
-        while stopped_loc == bkpt_dump.address :
-
-            start_addr    = ByteToInt( cpu.read_memory( data_int_addr   , size=4 ) )
-            end_addr      = ByteToInt( cpu.read_memory( data_int_addr+4 , size=4 ) )
-            file_var_addr = ByteToInt( cpu.read_memory( data_int_addr+8 , size=4 ) )
-
-            file_var = r''
-            mem_char = " "
-
-            while ord(mem_char) != 0:
-                mem_char = cpu.read_memory(file_var_addr)
-                file_var += str(mem_char)
-                file_var_addr += 1
-
-            filename = file_var.rstrip(' \t\r\n\0')
-            self.logger.prn_inf("dumping to " + filename)
-            with open(filename, "wb") as f:
-                mem = cpu.read_memory(start_addr, count=(end_addr-start_addr))
-                f.write(mem)
-
-            if self.__run_to_breakpoint():
-                stopped_loc = cpu.read_register('Core.R15')
-            else:
-                stopped_loc = cpu.read_register('Core.R15')
+        dumps = []
+        start_time = time.monotonic()
+        slowest = 0.0
+        stopped_loc = None
+        while True:
+            run_start = time.monotonic()
+            if not self.__run_to_breakpoint(self.coverage_timeout + COVERAGE_TIMEOUT_SCALE * slowest):
+                break
+            slowest = max(slowest, time.monotonic() - run_start)
+            stopped_loc = cpu.read_register('Core.R15')
+            if stopped_loc not in dump_addrs:
                 break
 
+            dump_start = time.monotonic()
+            gcov_var = memory.read_struct(data_int_addr, GCOV_VAR)
 
-        if stopped_loc == bkpt_exit.address:
-            self.logger.prn_inf("Coverage dump program run to the end.")
-        else:
-            self.logger.prn_wrn("Coverage dump ended somewhere else!!")
+            filename = memory.read_cstring(gcov_var.filename).rstrip(' \t\r\n\0')
+            with open(filename, "wb") as f:
+                f.write(memory.read(gcov_var.start, gcov_var.end - gcov_var.start))
+            dumps.append((filename, time.monotonic() - dump_start))
+            self.logger.prn_inf("dumped %s (%d bytes, %.3fs)", filename, gcov_var.end - gcov_var.start, dumps[-1][1])
+
+        self.coverage_dumps = dumps
+        if stopped_loc not in exit_addrs:
+            raise SimulatorError("Coverage dump did not reach the end of collect_coverage, stopped at %s after %d gcda files"
+                                 % ("?" if stopped_loc is None else hex(stopped_loc), len(dumps)))
+        self.logger.prn_inf("Coverage dump program run to the end.")
+        self.logger.prn_inf("Dumped %d gcda files in %.3fs", len(dumps), time.monotonic() - start_time)
         lcov_collect(os.path.basename(self.image))
+        return dumps
+
+    def target_memory(self, cpu_index=0):
+        """ return a TargetMemory accessor for a cpu of the launched fastmodel
+            @param cpu_index is the index into the model cpu list
+            @return None if the model is not running
+        """
+        if self.is_simulator_alive():
+            return TargetMemory(self.cpus[cpu_index])
+        return None
 
     def shutdown_simulator(self):
         """ shutdown fastmodel if any """
-        if self.is_simulator_alive():
-            if self.config_name == "COVERAGE":
-                self.__CodeCoverage()
-            self.logger.prn_inf("Fast-Model agent shutting down model")
-            self.__closeConnection()
-            self.model.release(shutdown=True)
-            self.model=None
-            time.sleep(1)
+        self.__stop_exit_monitor()
+        self.__stop_profiler()
+        # a terminal only model still needs its connection closed if the process already exited
+        if self.is_simulator_alive() or self.started:
+            self.__stop_run_clock()
+            shutdown_start = time.monotonic()
+            self.__record("shutdown")
+            try:
+                if self.config_name == "COVERAGE":
+                    self.__CodeCoverage()
+            finally:
+                # release the model even if the coverage dump failed
+                self.__release_model()
+                if self.recorder:
+                    # complete the session file now, a later run appends to it
+                    self.recorder.close()
+            self.phase_times['shutdown'] = time.monotonic() - shutdown_start
+            if self.run_history and self.image:
+                self.run_history.record(self.fastmodel_name, self.config_name, self.image, self.phase_times)
         else:
             self.logger.prn_inf("Model already shutdown")
 
+    def __release_model(self):
+        """ close the terminal and IRIS connections and stop the model process """
+        self.logger.prn_inf("Fast-Model agent shutting down model")
+        self.__closeConnection()
+        if not self.enable_iris:
+            self.started = False
+            if isinstance(self.subprocess, Popen):
+                self._supervisor.stop(self.subprocess)
+        else:
+            self.model.release(shutdown=True)
+            self.model=None
+            self.cpus = []
+            self.terminal = None
+            self._supervisor.stop(self.subprocess, grace=1)
+
+    def close(self):
+        """ shutdown the fastmodel and release every resource held by the agent
+            The terminal socket, IRIS connection and model process are released by shutdown_simulator,
+            then the telnet, gdb and networking ports go back to their allocators so other agents can reuse them.
+        """
+        try:
+            self.shutdown_simulator()
+        finally:
+            if isinstance(self.subprocess, Popen):
+                self._supervisor.stop(self.subprocess)
+            self.subprocess = None
+            self.__free_ports()
+            if self.recorder:
+                self.recorder.close()
+
+    def __free_ports(self):
+        """ give the telnet, gdb and networking ports back to their allocators """
+        for port in [self.telnet_port, self.gdb_port, self.tap_index] + list(self.net_ports.values()):
+            if port is not None and not port.freed:
+                port.allocator.free(port)
+        self.telnet_port = None
+        self.gdb_port = None
+        self.tap_index = None
+        self.tap_interface = None
+        self.net_ports = {}
+
     def list_avaliable_models(self):
         """ return a dictionary of models and configs """
         return self.configuration.get_all_configs()
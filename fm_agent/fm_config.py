@@ -98,6 +98,62 @@ class FastmodelConfig():
 
         return self.json_configs[model_name]["terminal_component"]
 
+    def get_user_net_ports(self,model_name):
+        """ get the guest ports to forward from the host with user mode networking
+            @return a list of guest ports from the model, or COMMON if the model has none
+            @return an empty list if not found
+        """
+        if model_name in self.json_configs and "user_net_ports" in self.json_configs[model_name]:
+            return self.json_configs[model_name]["user_net_ports"]
+
+        return self.json_configs.get("COMMON", {}).get("user_net_ports", [])
+
+    def get_tap_interfaces(self,model_name):
+        """ get the tap interfaces that can be handed out to instances of a model
+            @return a list of interface names from the model, or COMMON if the model has none
+            @return an empty list if not found
+        """
+        if model_name in self.json_configs and "tap_interfaces" in self.json_configs[model_name]:
+            return self.json_configs[model_name]["tap_interfaces"]
+
+        return self.json_configs.get("COMMON", {}).get("tap_interfaces", [])
+
+    def get_enable_iris(self,model_name):
+        """ get whether the model is driven over IRIS, or launched with the image as terminal only model
+            @return the setting from the model, or COMMON if the model has none
+            @return True if not found
+        """
+        return self.__get_agent_setting(model_name, "enable_iris", True)
+
+    def get_detect_exit(self,model_name):
+        """ get whether the agent watches for the target program exit
+            @return the setting from the model, or COMMON if the model has none
+            @return False if not found
+        """
+        return self.__get_agent_setting(model_name, "detect_exit", False)
+
+    def get_record(self,model_name):
+        """ get the file to record terminal traffic and lifecycle events to
+            @return the file from the model, or COMMON if the model has none
+            @return None if not found
+        """
+        record = self.__get_agent_setting(model_name, "record", None)
+        return getenv_replace(record) if record else None
+
+    def get_run_history(self,model_name):
+        """ get the run history database to store the phase durations of every run in
+            @return the database path from the model, or COMMON if the model has none
+            @return None if not found
+        """
+        run_history = self.__get_agent_setting(model_name, "run_history", None)
+        return getenv_replace(run_history) if run_history else None
+
+    def __get_agent_setting(self, model_name, key, default):
+        if model_name in self.json_configs and key in self.json_configs[model_name]:
+            return self.json_configs[model_name][key]
+
+        return self.json_configs.get("COMMON", {}).get(key, default)
+
     def get_configs (self,model_name):
         """ Search for configs with given model
             @return a dictionary of config_name:config_file for give model_name
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+mbed SDK
+Copyright (c) 2011-2021 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import os
+import hashlib
+import tempfile
+from .utils import get_cache_dir
+
+class ModelMetadataCache():
+    """ Persistent per-model metadata, keyed by model binary path and mtime
+        Entries written for an older build of a model binary are never returned.
+    """
+
+    # default cache file, inside get_cache_dir()
+    CACHE_FILE = "model_metadata.json"
+
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file or os.path.join(get_cache_dir(), self.CACHE_FILE)
+
+    def key(self, model_binary, *extra):
+        """ build the cache key of a model binary
+            @param extra are any other values the cached data depends on (config file, options...)
+            @return None if the binary does not exist
+        """
+        try:
+            mtime = os.stat(model_binary).st_mtime_ns
+        except OSError:
+            return None
+        digest = hashlib.sha1(json.dumps([os.path.abspath(model_binary), mtime] + list(extra)).encode())
+        return digest.hexdigest()
+
+    def get(self, key, field):
+        """ return a cached field for key, or None if not cached """
+        if key is None:
+            return None
+        return self._load().get(key, {}).get(field)
+
+    def set(self, key, field, value):
+        """ store a field for key, replacing the cache file atomically """
+        if key is None:
+            return
+        entries = self._load()
+        entries.setdefault(key, {})[field] = value
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(self.cache_file))
+            with os.fdopen(fd, "w") as tmp:
+                json.dump(entries, tmp)
+            os.replace(tmp_name, self.cache_file)
+        except OSError:
+            # cache is only an optimisation, never fail a run on it
+            pass
+
+    def _load(self):
+        try:
+            with open(self.cache_file, "r") as cache:
+                return json.load(cache)
+        except (OSError, ValueError):
+            return {}
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+mbed SDK
+Copyright (c) 2011-2021 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import time
+import threading
+from bisect import bisect_right
+from collections import Counter
+
+UNKNOWN_FUNCTION = "[unknown]"
+
+class SymbolIndex():
+    """ Address range index of the functions of an image
+        @param symbol_table is the output of read_symbol()
+    """
+    def __init__(self, symbol_table):
+        functions = {}
+        for line in symbol_table:
+            data = line.split()
+            if len(data) < 8 or data[3] != "FUNC":
+                continue
+            try:
+                start = int(data[1], 16) & ~1
+                size = int(data[2], 0)
+            except ValueError:
+                continue
+            # keep the largest symbol of aliases at the same address
+            if size and size > functions.get(start, (0, None))[0]:
+                functions[start] = (size, data[7])
+
+        self.starts = sorted(functions)
+        self.ends = [start + functions[start][0] for start in self.starts]
+        self.names = [functions[start][1] for start in self.starts]
+
+    def lookup(self, address):
+        """ return the name of the function containing address, UNKNOWN_FUNCTION if none """
+        index = bisect_right(self.starts, address) - 1
+        if index >= 0 and address < self.ends[index]:
+            return self.names[index]
+        return UNKNOWN_FUNCTION
+
+class PCSampler():
+    """ Sample the program counter of every running cpu of a model in the background
+        @param cpus is the list of IRIS cpu targets
+        @param index is the SymbolIndex of the loaded image
+        @param rate is the number of samples per second and per cpu
+        @param lock is held around every IRIS access, to share the model with other polling threads
+    """
+    def __init__(self, cpus, index, rate=1000, lock=None):
+        self.cpus = cpus
+        self.index = index
+        self.interval = 1.0 / rate
+        self.lock = lock or threading.Lock()
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, cpus=None):
+        """ start sampling, or resume after stop() adding to the same samples
+            @param cpus replaces the cpu targets, e.g. after the model was relaunched
+        """
+        if cpus is not None:
+            self.cpus = cpus
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ stop sampling, must be called before the model is touched from another thread """
+        self._stop.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        next_sample = time.monotonic()
+        while not self._stop.is_set():
+            for cpu in self.cpus:
+                try:
+                    with self.lock:
+                        # a halted cpu (exit breakpoint...) would pile samples on the halted pc
+                        if not cpu.is_running:
+                            continue
+                        pc = cpu.read_register('Core.R15')
+                except Exception:
+                    # model went away
+                    return
+                self.samples[(cpu.instName, self.index.lookup(pc))] += 1
+            next_sample += self.interval
+            self._stop.wait(max(0, next_sample - time.monotonic()))
+
+    def flat_profile(self):
+        """ return the flat profile as text, functions sorted by sample count per cpu """
+        lines = []
+        for cpu in sorted(set(cpu for cpu, _ in self.samples)):
+            counts = Counter({function: count for (name, function), count in self.samples.items() if name == cpu})
+            total = sum(counts.values())
+            lines.append("%s: %d samples" % (cpu, total))
+            lines.append("%8s %10s  %s" % ("%", "samples", "function"))
+            for function, count in counts.most_common():
+                lines.append("%8.2f %10d  %s" % (100.0 * count / total, count, function))
+            lines.append("")
+        return "\n".join(lines)
+
+    def collapsed_stacks(self):
+        """ return the samples in collapsed stack format, as consumed by flamegraph.pl """
+        return "".join("%s;%s %d\n" % (cpu, function, count) for (cpu, function), count in sorted(self.samples.items()))
+
+    def write(self, prefix):
+        """ write prefix.profile.txt and prefix.folded
+            @return the list of written files
+        """
+        files = [prefix + ".profile.txt", prefix + ".folded"]
+        with open(files[0], "w") as f:
+            f.write(self.flat_profile())
+        with open(files[1], "w") as f:
+            f.write(self.collapsed_stacks())
+        return files
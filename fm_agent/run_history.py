@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+mbed SDK
+Copyright (c) 2011-2021 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import time
+import heapq
+import sqlite3
+import threading
+from contextlib import contextmanager
+from statistics import median
+from .utils import get_cache_dir
+
+# phases timed by FastmodelAgent, in seconds
+PHASES = ("launch", "load", "run", "shutdown")
+
+class RunHistory():
+    """ Local database of how long each (model, config, image) run took, phase by phase
+        @param path is the sqlite database file, run_history.db in get_cache_dir() by default
+        The database is created on the first record(). If it cannot be opened, runs are not
+        recorded and estimate() behaves as if there was no history.
+    """
+
+    # default database file, inside get_cache_dir()
+    HISTORY_FILE = "run_history.db"
+
+    # number of most recent runs averaged by estimate()
+    WINDOW = 10
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(get_cache_dir(), self.HISTORY_FILE)
+        self._lock = threading.Lock()
+        self._created = False
+
+    @contextmanager
+    def _connect(self, create=False):
+        """ open the database for one transaction, committed and closed on exit
+            @param create makes the database and its directory if they do not exist yet
+        """
+        if not self._created:
+            if create:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            elif not os.path.exists(self.path):
+                raise sqlite3.OperationalError("no run history in %s" % self.path)
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                if not self._created:
+                    db.execute("CREATE TABLE IF NOT EXISTS runs (model TEXT, config TEXT, image TEXT, "
+                               "launch REAL, load REAL, run REAL, shutdown REAL, total REAL, finished REAL)")
+                    db.execute("CREATE INDEX IF NOT EXISTS runs_job ON runs (model, config, image, finished)")
+                    self._created = True
+                yield db
+        finally:
+            db.close()
+
+    def record(self, model, config, image, phases):
+        """ store the phase durations of one run
+            @param phases is a dictionary of phase name to seconds, missing phases count as 0
+        """
+        durations = [phases.get(phase, 0.0) for phase in PHASES]
+        try:
+            with self._lock, self._connect(create=True) as db:
+                db.execute("INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           [model, config, image] + durations + [sum(durations), time.time()])
+        except (OSError, sqlite3.Error):
+            # history is only used for scheduling, never fail a run on it
+            pass
+
+    def estimate(self, model, config, image, default=None):
+        """ predict the total duration of a run from its most recent runs
+            Falls back to any image on the same model and config when the image was never run.
+            @return seconds, or default if there is no history
+        """
+        try:
+            with self._lock, self._connect() as db:
+                rows = db.execute("SELECT total FROM runs WHERE model=? AND config=? AND image=? "
+                                  "ORDER BY finished DESC LIMIT ?", (model, config, image, self.WINDOW)).fetchall()
+                if not rows:
+                    rows = db.execute("SELECT total FROM runs WHERE model=? AND config=? "
+                                      "ORDER BY finished DESC LIMIT ?", (model, config, self.WINDOW)).fetchall()
+        except (OSError, sqlite3.Error):
+            rows = []
+        if not rows:
+            return default
+        return sum(row[0] for row in rows) / len(rows)
+
+    def schedule(self, jobs, workers, default=None):
+        """ shard jobs over workers longest first (LPT), to shorten the total wall time
+            @param jobs is a list of (model, config, image) tuples
+            @param default is the duration assumed for jobs without history, the median of known jobs if None
+            @return (shards, makespan): a list of job lists per worker and the predicted wall time in seconds
+        """
+        estimates = [self.estimate(*job) for job in jobs]
+        known = [estimate for estimate in estimates if estimate is not None]
+        if default is None:
+            default = median(known) if known else 0.0
+        estimates = [default if estimate is None else estimate for estimate in estimates]
+
+        shards = [[] for _ in range(workers)]
+        loads = [(0.0, worker) for worker in range(workers)]
+        for index in sorted(range(len(jobs)), key=lambda i: estimates[i], reverse=True):
+            load, worker = heapq.heappop(loads)
+            shards[worker].append(jobs[index])
+            heapq.heappush(loads, (load + estimates[index], worker))
+
+        return shards, max(load for load, _ in loads)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+"""
+mbed SDK
+Copyright (c) 2011-2021 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import gzip
+import json
+import time
+import threading
+from concurrent.futures import Future
+from .utils import FMLogger, printf_logger
+from .fm_config import FastmodelConfig
+
+def _open_session(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+class SessionRecorder():
+    """ Record the terminal traffic and lifecycle events of a FastmodelAgent
+        One JSON object per line: {"t": seconds since recording started, "ev": event, "data": payload},
+        terminal bytes are stored as latin-1 text. The file is gzip compressed if path ends with .gz
+        close() completes the file, a later event reopens it to append (as a new gzip member).
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = _open_session(path, "w")
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+
+    def event(self, ev, data=None):
+        """ record a lifecycle event ("setup", "start", "load", "run", "reset", "shutdown", "exit"...) """
+        entry = {"t": round(time.monotonic() - self._start, 6), "ev": ev}
+        if data is not None:
+            entry["data"] = data
+        with self._lock:
+            if not self._file:
+                self._file = _open_session(self.path, "a")
+            self._file.write(json.dumps(entry, separators=(',', ':')) + "\n")
+
+    def traffic(self, direction, data):
+        """ record terminal bytes, direction is "rx" or "tx" """
+        if data:
+            self.event(direction, bytes(data).decode("latin-1"))
+
+    def close(self):
+        """ flush and complete the file, e.g. write the gzip trailer """
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+class ReplayAgent():
+    """ FastmodelAgent look-alike serving a recorded session, no Fast Models installation required
+        @param path is a file written by FastmodelAgent(record=path)
+        @param speed scales the recorded timing, 2.0 replays twice as fast, 0 as fast as possible
+        Offers the host test interface of FastmodelAgent: the simulator lifecycle, read/write, exit_future,
+        add_exit_callback and the model and config queries. Debugging, profiling, coverage and target
+        memory access need a running model and are not available.
+    """
+    def __init__(self, path, speed=1.0, logger=None):
+        self.logger = printf_logger(logger) if logger else FMLogger('fm_agent')
+        self.speed = speed
+        self.read_timeout = 0.2
+        self.configuration = FastmodelConfig()
+        with _open_session(path, "r") as session:
+            self.events = [json.loads(line) for line in session if line.strip()]
+
+        setup = next((e for e in self.events if e["ev"] == "setup"), {"data": {}})
+        self.fastmodel_name = setup["data"].get("model")
+        self.config_name = setup["data"].get("config")
+        self.image = None
+        self.alive = False
+        self._cursor = 0
+        self._base = 0
+        self._wall_start = 0
+        self._pending = bytearray()
+        self._exit_future = None
+        self._exit_callbacks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def setup_simulator(self, model_name, model_config):
+        self.fastmodel_name = model_name
+        self.config_name = model_config
+
+    def is_simulator_alive(self):
+        return self.alive
+
+    def start_simulator(self, stream=None):
+        self._seek("start")
+        self.alive = True
+        return True
+
+    def load_simulator(self, image):
+        if not self.alive:
+            return False
+        self.image = image
+        return True
+
+    def run_simulator(self, profile_rate=None):
+        if not self.alive:
+            return False
+        return self._seek("run") and self._new_exit_future()
+
+    def reset_simulator(self):
+        if not self.alive:
+            return False
+        self.logger.prn_wrn("Replaying FastModel reset")
+        return self._seek("reset") and self._new_exit_future()
+
+    @property
+    def exit_future(self):
+        """ concurrent.futures.Future resolved with the recorded exit code once the replay reaches it """
+        return self._exit_future
+
+    def add_exit_callback(self, callback):
+        """ call callback(exit_code) when the replay reaches a recorded exit, for this and later runs """
+        self._exit_callbacks.append(callback)
+        if self._exit_future:
+            self._exit_future.add_done_callback(lambda future: callback(future.result()))
+
+    def _new_exit_future(self):
+        self._exit_future = Future()
+        for callback in self._exit_callbacks:
+            self._exit_future.add_done_callback(lambda future, callback=callback: callback(future.result()))
+        return True
+
+    def shutdown_simulator(self):
+        self.alive = False
+
+    def close(self):
+        self.shutdown_simulator()
+
+    def list_avaliable_models(self):
+        """ return a dictionary of models and configs """
+        return self.configuration.get_all_configs()
+
+    def list_model_binary(self, model_name):
+        """ return model binary full path of give model_name """
+        return self.configuration.get_model_binary(model_name)
+
+    def check_config_exist(self, filename):
+        """ return the presents of give config name """
+        return os.path.exists(os.path.join(os.path.dirname(__file__), "configs", filename))
+
+    def write(self, payload, log=False):
+        if not self.alive:
+            return False
+        if log:
+            self.logger.prn_txd(payload)
+        return True
+
+    def read(self, end='\n', bs=-1):
+        """ return recorded terminal data as it becomes due, with the semantics of FastmodelAgent.read """
+        if not self.alive:
+            return None
+        if bs is None:
+            bs = -1
+        end = end.encode() if isinstance(end, str) else end or b''
+
+        data = bytearray()
+        deadline = time.monotonic() + self.read_timeout
+        while True:
+            if not self._pending and not self._next_rx(deadline):
+                return data
+            char = self._pending[:1]
+            del self._pending[:1]
+            data += char
+            if (end and data.endswith(end)) or (bs >= 0 and len(data) >= bs):
+                return data
+            deadline = time.monotonic() + self.read_timeout
+
+    def _seek(self, ev):
+        """ move the replay to just after the next ev event and restart the clock """
+        while self._cursor < len(self.events):
+            event = self.events[self._cursor]
+            self._cursor += 1
+            if event["ev"] == ev:
+                self._base = event["t"]
+                self._wall_start = time.monotonic()
+                self._pending.clear()
+                return True
+        self.logger.prn_err("Recorded session has no more '%s' events", ev)
+        return False
+
+    def _next_rx(self, deadline):
+        """ move the next received chunk into the pending buffer once due, waiting until deadline
+            @return False if no data became available
+        """
+        while self._cursor < len(self.events):
+            event = self.events[self._cursor]
+            if event["ev"] in ("run", "reset", "shutdown"):
+                # end of this run, the host must trigger the next one
+                break
+            if event["ev"] == "exit" and self._exit_future and not self._exit_future.done():
+                self._exit_future.set_result(event.get("data"))
+            if event["ev"] != "rx":
+                self._cursor += 1
+                continue
+            if self.speed:
+                due = self._wall_start + (event["t"] - self._base) / self.speed
+                wait = due - time.monotonic()
+                if wait > 0:
+                    if due > deadline:
+                        time.sleep(max(0, deadline - time.monotonic()))
+                        return False
+                    time.sleep(wait)
+            self._pending += event["data"].encode("latin-1")
+            self._cursor += 1
+            return True
+        time.sleep(max(0, deadline - time.monotonic()))
+        return False
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+"""
+mbed SDK
+Copyright (c) 2011-2021 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import atexit
+import socket
+import threading
+from subprocess import TimeoutExpired
+from .utils import get_cache_dir, ON_POSIX
+
+# prctl option from <linux/prctl.h>
+PR_SET_PDEATHSIG = 1
+
+_prctl = None
+
+def _resolve_prctl():
+    """ look up libc prctl() in the agent process, nothing is imported or loaded after fork
+        @return the prctl function, None if not available
+    """
+    global _prctl
+    if _prctl is None:
+        try:
+            import ctypes
+            _prctl = ctypes.CDLL(None, use_errno=True).prctl
+        except (ImportError, OSError, AttributeError):
+            _prctl = False
+    return _prctl or None
+
+def _child_setup(prctl, parent_pid, death_signal):
+    """ runs in the forked child before exec: ask the kernel to kill the model when the agent dies """
+    if prctl(PR_SET_PDEATHSIG, death_signal) != 0:
+        return
+    # the parent may already be gone before prctl took effect
+    if os.getppid() != parent_pid:
+        os._exit(1)
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    # a zombie is already dead, it only waits for its parent to collect it
+    try:
+        with open("/proc/%d/stat" % pid, "rb") as stat:
+            return stat.read().rsplit(b')', 1)[1].split()[0] != b'Z'
+    except (OSError, IndexError):
+        return True
+
+class ProcessSupervisor():
+    """ Supervise launched model processes
+        Every model runs in its own process group (or gets a death signal on Linux) and is
+        recorded in a lease registry, so models leaked by a crashed or killed agent can be
+        reaped by the next agent that starts on the same host. Leases name their host, so a
+        registry shared between hosts (e.g. a home directory on NFS) is safe.
+    """
+
+    # lease directory, inside get_cache_dir()
+    LEASE_DIR = "leases"
+
+    def __init__(self, lease_dir=None, stop_timeout=5.0):
+        self._lease_dir = lease_dir
+        self.stop_timeout = stop_timeout
+        self._lock = threading.Lock()
+        self._children = {}
+        self._reaped = False
+        atexit.register(self.stop_all)
+
+    @property
+    def lease_dir(self):
+        if not self._lease_dir:
+            self._lease_dir = os.path.join(get_cache_dir(), self.LEASE_DIR)
+        return self._lease_dir
+
+    def popen_kwargs(self):
+        """ return the extra Popen arguments to launch a supervised model process """
+        if not ON_POSIX:
+            import subprocess
+            return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+        kwargs = {'start_new_session': True}
+        # PDEATHSIG fires when the launching *thread* exits, only safe from the main thread
+        if sys.platform.startswith('linux') and threading.current_thread() is threading.main_thread():
+            prctl = _resolve_prctl()
+            if prctl:
+                parent_pid = os.getpid()
+                kwargs['preexec_fn'] = lambda: _child_setup(prctl, parent_pid, signal.SIGKILL)
+        return kwargs
+
+    def register(self, proc, model_binary, ports=()):
+        """ record a lease for a launched model process """
+        lease = {
+            'host': socket.gethostname(),
+            'pid': proc.pid,
+            'owner': os.getpid(),
+            'binary': model_binary,
+            'ports': [int(port) for port in ports if port is not None],
+            'started': time.time(),
+        }
+        with self._lock:
+            self._children[proc.pid] = proc
+        try:
+            os.makedirs(self.lease_dir, exist_ok=True)
+            with open(self._lease_file(proc.pid), "w") as lease_file:
+                json.dump(lease, lease_file)
+        except OSError:
+            pass
+
+    def release(self, proc):
+        """ forget a model process and drop its lease """
+        with self._lock:
+            self._children.pop(proc.pid, None)
+        try:
+            os.remove(self._lease_file(proc.pid))
+        except OSError:
+            pass
+
+    def stop(self, proc, grace=0, timeout=None):
+        """ stop a model process, escalating from terminate to kill
+            @param grace is how long to wait for the process to exit on its own first
+            @param timeout is how long to wait after terminate before killing
+            @return the process return code
+        """
+        if timeout is None:
+            timeout = self.stop_timeout
+        try:
+            if grace:
+                try:
+                    return self._finish(proc, proc.wait(grace))
+                except TimeoutExpired:
+                    pass
+            if proc.poll() is None:
+                self._signal(proc, kill=False)
+                try:
+                    return self._finish(proc, proc.wait(timeout))
+                except TimeoutExpired:
+                    self._signal(proc, kill=True)
+            return self._finish(proc, proc.wait())
+        except OSError:
+            return self._finish(proc, proc.poll())
+
+    def stop_all(self):
+        """ stop every model process launched by this agent process """
+        with self._lock:
+            children = list(self._children.values())
+        for proc in children:
+            self.stop(proc, timeout=1)
+
+    def reap_orphans(self):
+        """ kill models whose owning agent process no longer exists, once per agent process
+            Only leases of this host are considered, pids of other hosts mean nothing here.
+            @return list of reaped model pids
+        """
+        with self._lock:
+            if self._reaped:
+                return []
+            self._reaped = True
+
+        reaped = []
+        host = socket.gethostname()
+        try:
+            lease_files = os.listdir(self.lease_dir)
+        except OSError:
+            return reaped
+
+        for name in lease_files:
+            path = os.path.join(self.lease_dir, name)
+            try:
+                with open(path, "r") as lease_file:
+                    lease = json.load(lease_file)
+            except (OSError, ValueError):
+                continue
+            if lease.get('host') != host or _pid_alive(lease['owner']):
+                continue
+            if _pid_alive(lease['pid']) and self._is_model(lease['pid'], lease['binary']):
+                self._kill_orphan(lease['pid'])
+                reaped.append(lease['pid'])
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return reaped
+
+    def _finish(self, proc, returncode):
+        self.release(proc)
+        return returncode
+
+    def _lease_file(self, pid):
+        return os.path.join(self.lease_dir, "%d.json" % pid)
+
+    def _signal(self, proc, kill):
+        """ terminate or kill the whole process group of a model """
+        if not ON_POSIX:
+            if kill:
+                proc.kill()
+            else:
+                proc.terminate()
+            return
+        sig = signal.SIGKILL if kill else signal.SIGTERM
+        try:
+            os.killpg(proc.pid, sig)
+        except OSError:
+            proc.send_signal(sig)
+
+    def _is_model(self, pid, model_binary):
+        """ guard against pid reuse before killing a process we did not launch """
+        if not ON_POSIX:
+            return False
+        try:
+            with open("/proc/%d/cmdline" % pid, "rb") as cmdline:
+                return cmdline.read().split(b'\0')[0].decode(errors='replace') == model_binary
+        except OSError:
+            # no procfs, only trust a session leader, as started by popen_kwargs()
+            try:
+                return os.getsid(pid) == pid
+            except OSError:
+                return False
+
+    def _kill_orphan(self, pid):
+        for sig, wait in ((signal.SIGTERM, self.stop_timeout), (signal.SIGKILL, 1)):
+            try:
+                os.killpg(pid, sig)
+            except OSError:
+                return
+            deadline = time.monotonic() + wait
+            while time.monotonic() < deadline:
+                if not _pid_alive(pid):
+                    return
+                time.sleep(0.05)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""
+mbed SDK
+Copyright (c) 2011-2021 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import struct
+from collections import namedtuple
+
+
+class TargetStruct():
+    """ Typed view definition of a C struct living in target memory
+        @param name is the name of the struct, used for the returned namedtuple
+        @param fields is a list of (field_name, struct_format_char) tuples, in memory order
+        @param byteorder is the struct byte order prefix, little endian by default
+    """
+    def __init__(self, name, fields, byteorder='<'):
+        self.tuple_type = namedtuple(name, [field for field, _ in fields])
+        self.struct = struct.Struct(byteorder + ''.join(fmt for _, fmt in fields))
+        self.size = self.struct.size
+
+    def unpack(self, buffer, offset=0):
+        """ decode one struct from a buffer without copying it """
+        return self.tuple_type._make(self.struct.unpack_from(buffer, offset))
+
+
+class TargetMemory():
+    """ Memory access helpers on top of an IRIS target (usually a cpu)
+        Every helper issues a single read_memory() per contiguous region and decodes
+        the result in place with struct/memoryview.
+    """
+    CSTRING_CHUNK = 64
+
+    def __init__(self, target, byteorder='little'):
+        self.target = target
+        self.byteorder = byteorder
+        self._prefix = '<' if byteorder == 'little' else '>'
+
+    def read(self, address, length):
+        """ read a contiguous region of target memory
+            @return a memoryview of length bytes
+        """
+        if length <= 0:
+            return memoryview(b'')
+        data = self.target.read_memory(address, count=length)
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            data = bytearray(data)
+        return memoryview(data)
+
+    def read_int(self, address, size=4, signed=False):
+        """ read a single integer of size bytes """
+        return int.from_bytes(self.read(address, size), self.byteorder, signed=signed)
+
+    def read_u32(self, address):
+        """ read a single unsigned 32-bit word """
+        return self.read_int(address, 4)
+
+    def read_words(self, address, count):
+        """ read count adjacent unsigned 32-bit words in one access
+            @return a tuple of integers
+        """
+        return struct.unpack_from('%s%dI' % (self._prefix, count), self.read(address, 4 * count))
+
+    def read_struct(self, address, target_struct):
+        """ read and decode a TargetStruct at address
+            @return a namedtuple of the struct fields
+        """
+        return target_struct.unpack(self.read(address, target_struct.size))
+
+    def read_cstring(self, address, max_length=4096, encoding='utf-8'):
+        """ read a NUL terminated string, fetching up to CSTRING_CHUNK bytes per access
+            Accesses stop at CSTRING_CHUNK aligned boundaries, so a string at the end of a mapped
+            region is not read past the region; a failing access is retried byte by byte.
+        """
+        data = bytearray()
+        chunk_size = self.CSTRING_CHUNK
+        while len(data) < max_length:
+            current = address + len(data)
+            length = min(chunk_size - current % chunk_size, max_length - len(data))
+            try:
+                chunk = self.read(current, length)
+            except Exception:
+                if chunk_size == 1:
+                    raise
+                chunk_size = 1
+                continue
+            searched = len(data)
+            data += chunk
+            end = data.find(b'\0', searched)
+            if end >= 0:
+                del data[end:]
+                break
+        return data.decode(encoding, errors='replace')
+
+    def read_batch(self, regions, max_gap=64):
+        """ read several (address, length) regions, merging neighbours into one access
+            @param regions is a list of (address, length) tuples
+            @param max_gap is the largest hole between two regions still worth reading through
+            @return a list of memoryviews in the same order as regions
+        """
+        order = sorted(range(len(regions)), key=lambda i: regions[i][0])
+        results = [None] * len(regions)
+
+        span_start = span_end = None
+        members = []
+
+        def flush():
+            if members:
+                view = self.read(span_start, span_end - span_start)
+                for index in members:
+                    address, length = regions[index]
+                    results[index] = view[address - span_start:address - span_start + length]
+
+        for index in order:
+            address, length = regions[index]
+            if span_start is not None and address <= span_end + max_gap:
+                span_end = max(span_end, address + length)
+            else:
+                flush()
+                span_start, span_end, members = address, address + length, []
+            members.append(index)
+        flush()
+
+        return results
@@ -17,8 +17,14 @@ limitations under the License.
 """
 
 import os
+import re
 import sys
+import time
+import atexit
 import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from collections import deque
 from functools import partial
 import subprocess
 from subprocess import Popen, PIPE, STDOUT
@@ -33,18 +39,67 @@ class SimulatorError(Exception):
     """
     pass
 
+# FMLogger tags and the logging level they are emitted at
+LOG_LEVELS = {
+    'DBG' : logging.DEBUG,
+    'INF' : logging.INFO,
+    'WRN' : logging.WARNING,
+    'ERR' : logging.ERROR,
+    'TXT' : logging.DEBUG,
+    'TXD' : logging.DEBUG,
+    'RXD' : logging.DEBUG,
+}
+
+_log_queue = None
+_log_lock = threading.Lock()
+
+def _get_log_queue():
+    """ return the queue of the shared asynchronous stdout log handler, starting it on first use """
+    global _log_queue
+    with _log_lock:
+        if _log_queue is None:
+            handler = logging.StreamHandler(sys.stdout)
+            handler.setFormatter(logging.Formatter('[%(created).2f][%(name)s]%(message)s'))
+            _log_queue = Queue()
+            listener = QueueListener(_log_queue, handler)
+            listener.start()
+            atexit.register(listener.stop)
+        return _log_queue
+
+class _DeferredQueueHandler(QueueHandler):
+    """ queue handler leaving message formatting to the listener thread """
+    def prepare(self, record):
+        return record
+
+class _LogMessage(object):
+    """ log message formatted only when a handler emits it """
+    __slots__ = ('logger_level', 'text', 'args')
+
+    def __init__(self, logger_level, text, args):
+        self.logger_level = logger_level
+        self.text = text
+        self.args = args
+
+    def __str__(self):
+        return '[%s] %s' % (self.logger_level, self.text % self.args if self.args else self.text)
+
 class FMLogger(object):
-    """! Yet another logger flavour """
+    """! Yet another logger flavour
+        Records go through a queue to a stdout handler running in its own thread, unless the
+        application already configured the root logger, and are only formatted when emitted.
+        prn_* accept printf style arguments, e.g. logger.prn_inf("port %d", port)
+    """
     def __init__(self, name, lv=logging.INFO):
-        logging.basicConfig(stream=sys.stdout,format='[%(created).2f][%(name)s]%(message)s', level=lv)
         self.logger = logging.getLogger(name)
-        self.format_str = '[%(logger_level)s] %(message)s'
+        self.logger.setLevel(lv)
+        if not logging.getLogger().handlers and not any(isinstance(h, QueueHandler) for h in self.logger.handlers):
+            self.logger.addHandler(_DeferredQueueHandler(_get_log_queue()))
+            self.logger.propagate = False
 
-        def __prn_log(self, logger_level, text, timestamp=None):
-            self.logger.debug(self.format_str% {
-                'logger_level' : logger_level,
-                'message' : text,
-            })
+        def __prn_log(self, logger_level, text, *args, timestamp=None):
+            level = LOG_LEVELS[logger_level]
+            if self.logger.isEnabledFor(level):
+                self.logger.log(level, _LogMessage(logger_level, text, args))
 
         self.prn_dbg = partial(__prn_log, self, 'DBG')
         self.prn_wrn = partial(__prn_log, self, 'WRN')
@@ -54,6 +109,68 @@ class FMLogger(object):
         self.prn_txd = partial(__prn_log, self, 'TXD')
         self.prn_rxd = partial(__prn_log, self, 'RXD')
 
+class _PrintfLogger(object):
+    """ printf style prn_* on top of a logger whose prn_* take one formatted text, like the htrun logger """
+    PRN = ('prn_dbg', 'prn_wrn', 'prn_err', 'prn_inf', 'prn_txt', 'prn_txd', 'prn_rxd')
+
+    def __init__(self, logger):
+        self.logger = logger
+        for name in self.PRN:
+            if hasattr(logger, name):
+                setattr(self, name, partial(self.__prn_log, getattr(logger, name)))
+
+    @staticmethod
+    def __prn_log(prn, text, *args, **kwargs):
+        prn(text % args if args else text, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.logger, name)
+
+def printf_logger(logger):
+    """ return logger with prn_* accepting printf style arguments, as FMLogger does """
+    if isinstance(logger, (FMLogger, _PrintfLogger)):
+        return logger
+    return _PrintfLogger(logger)
+
+class TrafficRing(object):
+    """ In-memory ring of the most recent terminal traffic
+        @param max_bytes is how much RXD/TXD data is kept, oldest data is dropped first
+    """
+    def __init__(self, max_bytes=16 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = deque()
+
+    def append(self, direction, data):
+        """ record data sent (TXD) or received (RXD) on the terminal """
+        if not data:
+            return
+        if self.entries and self.entries[-1][0] == direction:
+            self.entries[-1][1].extend(data)
+        else:
+            self.entries.append((direction, bytearray(data)))
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            oldest = self.entries[0][1]
+            excess = self.size - self.max_bytes
+            if len(oldest) <= excess:
+                self.entries.popleft()
+                self.size -= len(oldest)
+            else:
+                del oldest[:excess]
+                self.size -= excess
+
+    def dump(self, logger):
+        """ log the recorded traffic as warnings tagged RXD/TXD and clear the ring
+            The traffic is dumped on failures, it must show at the default INFO level.
+            @param logger has printf style prn_* (see printf_logger)
+        """
+        for direction, data in self.entries:
+            for line in data.decode(errors='replace').splitlines():
+                logger.prn_wrn("[%s] %s", direction, line)
+        self.entries.clear()
+        self.size = 0
+
 def check_import(model_name=""):
     """ try PyIRIS API iris.debug can be imported """
     warning_msgs = []
@@ -80,15 +197,14 @@ def check_import(model_name=""):
         return True
 
 def read_symbol(image):
-    """this function reads images symbol to a global variable"""
-    symbol_table = []
+    """ read the symbol table of an image with arm-none-eabi-readelf
+        @return the readelf output lines
+        @raise SimulatorError if the symbols cannot be read
+    """
     try:
-        symbol_table =  subprocess.check_output('arm-none-eabi-readelf -sW "{}"'.format(image), shell=True).split("\n")
+        return subprocess.check_output('arm-none-eabi-readelf -sW "{}"'.format(image), shell=True, universal_newlines=True).split("\n")
     except Exception as e:
-        print("Make sure you have arm-none-eabi-readelf tool in PATH")
-        print("ERROR - {}.".format(str(e)))
-        sys.exit(1)
-    return symbol_table
+        raise SimulatorError("Cannot read symbols of %s, make sure you have arm-none-eabi-readelf tool in PATH: %s" % (image, e))
 
 def get_symbol_addr(symbol_table, symbol_name):
     """
@@ -102,8 +218,52 @@ def get_symbol_addr(symbol_table, symbol_name):
         if symbol_name in data:
             return data[1]
 
+def get_symbol_range(symbol_table, symbol_name):
+    """ return (start address, size) of a symbol, with the thumb bit cleared
+        @return None if the symbol is not in the table
+    """
+    for line in symbol_table:
+        data = line.split()
+        if len(data) >= 8 and data[7] == symbol_name:
+            return (HexToInt(data[1]) & ~1, int(data[2], 0))
+    return None
+
+# instructions returning from a function, as printed by objdump
+RETURN_INSN = re.compile(r'^\s*([0-9a-f]+):\s+(?:[0-9a-f]{2,8} ?)+\s+(?:pop(?:\.w)?\s+\{.*\bpc\}|ldmia(?:\.w)?\s+sp!,\s+\{.*\bpc\}|ldr(?:\.w)?\s+pc,\s+\[sp\]|bx\s+lr)')
+
+# unconditional branches, a tail call when the target is outside of the function
+BRANCH_INSN = re.compile(r'^\s*([0-9a-f]+):\s+(?:[0-9a-f]{2,8} ?)+\s+b(?:\.[nw])?\s+([0-9a-f]+)\b')
+
+def parse_return_addrs(disassembly, start, size):
+    """ return the addresses of the instructions leaving a function, from its objdump disassembly
+        Returns and tail calls (branches out of [start, start + size)) are both exits.
+    """
+    addresses = []
+    for line in disassembly.split("\n"):
+        match = RETURN_INSN.match(line)
+        if match:
+            addresses.append(HexToInt(match.group(1)))
+            continue
+        match = BRANCH_INSN.match(line)
+        if match and not start <= HexToInt(match.group(2)) < start + size:
+            addresses.append(HexToInt(match.group(1)))
+    return addresses
+
+def get_return_addrs(image, start, size):
+    """ disassemble a function with arm-none-eabi-objdump and return the addresses of its exits
+        @return an empty list if objdump is not available
+    """
+    try:
+        disassembly = subprocess.check_output('arm-none-eabi-objdump -d --start-address={} --stop-address={} "{}"'.format(
+            hex(start), hex(start + size), image), shell=True, universal_newlines=True)
+    except Exception as e:
+        print("Make sure you have arm-none-eabi-objdump tool in PATH")
+        print("ERROR - {}.".format(str(e)))
+        return []
+    return parse_return_addrs(disassembly, start, size)
+
 def ByteToInt( byteList ):
-    return int(''.join( [ "{:02x}".format(x) for x in reversed(byteList) ] ),16)
+    return int.from_bytes(bytes(byteList), 'little')
 
 def HexToInt( hex ):
     return int(hex,16)
@@ -124,14 +284,16 @@ def enqueue_output(out, queue):
         queue.put(line)
     out.close()
 
-def launch_FVP_IRIS(model_exec, config_file='', model_options=[]):
-    """Launch FVP with IRIS Server listening"""
+def launch_FVP_IRIS(model_exec, config_file='', model_options=[], popen_kwargs={}, logger=None):
+    """Launch FVP with IRIS Server listening
+        @param logger logs the command line, FMLogger('fm_agent') if not given
+    """
     cmd_line = [model_exec, '-I', '-p']
     cmd_line.extend(model_options)
     if config_file:
         cmd_line.extend(['-f' , config_file])
-    logging.info(cmd_line)
-    fm_proc = Popen(cmd_line,stdout=PIPE,stderr=STDOUT, close_fds=ON_POSIX)
+    (logger or FMLogger('fm_agent')).prn_inf("%s", cmd_line)
+    fm_proc = Popen(cmd_line,stdout=PIPE,stderr=STDOUT, close_fds=ON_POSIX, **popen_kwargs)
     out_q = Queue()
     reader_t = Thread(target=enqueue_output, args=(fm_proc.stdout, out_q))
     reader_t.daemon = True
@@ -152,6 +314,117 @@ def launch_FVP_IRIS(model_exec, config_file='', model_options=[]):
 
     return (fm_proc, port, stdout)
 
+def get_cache_dir():
+    """ return the directory used for fm_agent persistent caches
+        FM_AGENT_CACHE_DIR overrides the default location under XDG_CACHE_HOME or ~/.cache
+        The directory is not created here, writers create it on first use.
+    """
+    cache_dir = os.environ.get('FM_AGENT_CACHE_DIR')
+    if not cache_dir:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        cache_dir = os.path.join(base, 'mbed-fastmodel-agent')
+    return cache_dir
+
+def launch_FVP_terminal(model_exec, config_file='', model_options=[], image=None, terminal='telnetterminal0',
+                        popen_kwargs={}, timeout=30, logger=None):
+    """Launch FVP without IRIS Server, running image straight away
+        @param terminal is the instance name of the telnet terminal to wait for
+        @param logger logs the command line, FMLogger('fm_agent') if not given
+        @return (process, telnet port, stdout), port is 0 if the terminal never started listening
+    """
+    cmd_line = [model_exec]
+    cmd_line.extend(model_options)
+    if config_file:
+        cmd_line.extend(['-f' , config_file])
+    if image:
+        cmd_line.extend(['-a' , image])
+    (logger or FMLogger('fm_agent')).prn_inf("%s", cmd_line)
+    fm_proc = Popen(cmd_line,stdout=PIPE,stderr=STDOUT, close_fds=ON_POSIX, **popen_kwargs)
+    out_q = Queue()
+    reader_t = Thread(target=enqueue_output, args=(fm_proc.stdout, out_q))
+    reader_t.daemon = True
+    reader_t.start()
+
+    listening = re.compile(r'%s: Listening for serial connection on port (\d+)' % re.escape(terminal))
+    stdout=''
+    port = 0
+    deadline = time.monotonic() + timeout
+
+    while not port and time.monotonic() < deadline:
+        try: line = out_q.get(timeout=0.1).decode().strip()
+        except Empty:
+            if fm_proc.poll() is not None and out_q.empty():
+                break
+        else:
+            match = listening.search(line)
+            if match:
+                port = int(match.group(1))
+            stdout = stdout + line + "\n"
+
+    return (fm_proc, port, stdout)
+
+def list_model_params(model_exec, timeout=60):
+    """ query the parameter names of a model binary with --list-params
+        @return a list of parameter names, None if the model could not be queried
+    """
+    try:
+        output = subprocess.check_output([model_exec, '--list-params'], stderr=subprocess.DEVNULL,
+                                         universal_newlines=True, timeout=timeout)
+    except Exception as e:
+        print("Warning: Could not list parameters of '%s': %s" % (model_exec, str(e)))
+        return None
+    params = []
+    for line in output.split("\n"):
+        line = line.strip()
+        if '=' in line and not line.startswith('#'):
+            params.append(line.split('=', 1)[0].strip())
+    if not params:
+        # every model has parameters, an empty list means the query did not work
+        print("Warning: No parameters listed by '%s'" % model_exec)
+        return None
+    return params
+
+def read_config_params(config_file):
+    """ read the parameter names set by a model config file
+        @return a list of (line number, parameter name)
+    """
+    params = []
+    with open(config_file, "r") as config:
+        for lineno, line in enumerate(config, 1):
+            line = line.strip()
+            if line and not line.startswith('#') and '=' in line:
+                params.append((lineno, line.split('=', 1)[0].strip()))
+    return params
+
+def read_config_values(config_file):
+    """ read the parameters set by a model config file
+        @return a dictionary of parameter name: value, both as written in the file
+    """
+    values = {}
+    with open(config_file, "r") as config:
+        for line in config:
+            line = line.strip()
+            if line and not line.startswith('#') and '=' in line:
+                name, value = line.split('=', 1)
+                values[name.strip()] = value.strip()
+    return values
+
+def option_params(model_options):
+    """ return the parameter names set by -C options in a model command line
+        Parameters of a plugin loaded with --plugin on the same command line are left out,
+        the model does not list them.
+    """
+    plugins = set()
+    for option, value in zip(model_options, model_options[1:] + ['']):
+        if option.startswith('--plugin='):
+            value = option.split('=', 1)[1]
+        elif option != '--plugin':
+            continue
+        plugins.add(os.path.splitext(os.path.basename(value))[0])
+    return [name for name in (value.split('=', 1)[0].strip() for option, value in zip(model_options, model_options[1:])
+                              if option == '-C' and '=' in value)
+            if not plugins.intersection(name.split('.'))]
+
 def getenv_replace(s):
     """Replace substrings enclosed by {{ and }} with values from the environment so that e.g. '{{USER}}' becomes 'root'.
     """
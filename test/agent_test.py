@@ -1,4 +1,12 @@
-from unittest import TestCase
+import os
+import sys
+import socket
+import asyncio
+import tempfile
+import unittest
+import subprocess
+from concurrent.futures import Future
+from unittest import TestCase, mock
 
 import fm_agent
 
@@ -18,4 +26,101 @@ class TestFastmodelAgent(TestCase):
         s = fm_agent.create("FVP_MPS2_M3","MPS2")
         self.assertTrue(s.fastmodel_name)
         self.assertTrue(s.config_name)
-        self.assertTrue(s.configuration)
\ No newline at end of file
+        self.assertTrue(s.configuration)
+    def test_context_manager_frees_ports(self):
+        with fm_agent.create("FVP_MPS2_M3","MPS2") as s:
+            port = s.telnet_port.value
+            self.assertIn(port, s._telnet_port_allocator.ports)
+        self.assertIsNone(s.telnet_port)
+        self.assertNotIn(port, s._telnet_port_allocator.ports)
+    def test_async_context_manager_frees_ports(self):
+        async def run():
+            async with fm_agent.create("FVP_MPS2_M3","MPS2") as s:
+                port = s.telnet_port.value
+            return s, port
+        s, port = asyncio.run(run())
+        self.assertIsNone(s.telnet_port)
+        self.assertNotIn(port, s._telnet_port_allocator.ports)
+    def test_agent_settings(self):
+        s = fm_agent.create()
+        s.configuration.json_configs["FVP_MPS2_M3"].update(enable_iris=False, detect_exit=True)
+        s.setup_simulator("FVP_MPS2_M3","MPS2")
+        self.assertFalse(s.enable_iris)
+        self.assertTrue(s.detect_exit)
+        s.close()
+    def test_agent_arguments_override_settings(self):
+        s = fm_agent.create(enable_iris=True, detect_exit=False)
+        s.configuration.json_configs["FVP_MPS2_M3"].update(enable_iris=False, detect_exit=True)
+        s.setup_simulator("FVP_MPS2_M3","MPS2")
+        self.assertTrue(s.enable_iris)
+        self.assertFalse(s.detect_exit)
+        s.close()
+    def test_gdbserver_on_demand(self):
+        s = fm_agent.create("FVP_MPS2_M3","MPS2",enable_gdbserver=fm_agent.GDB_ON_DEMAND)
+        self.assertIsNone(s.gdb_port)
+        self.assertNotIn('GDBRemoteConnection.so', s.model_options)
+        s.close()
+        s = fm_agent.create("FVP_MPS2_M3","MPS2",enable_gdbserver=True)
+        self.assertIn('GDBRemoteConnection.so', s.model_options)
+        s.close()
+    def test_gdbserver_on_failed_exit(self):
+        s = fm_agent.create("FVP_MPS2_M3","MPS2",enable_gdbserver=fm_agent.GDB_ON_DEMAND,detect_exit=True)
+        requested = []
+        for code in (0, 1):
+            future = Future()
+            future.set_result(code)
+            s._FastmodelAgent__log_exit(future)
+            requested.append(s.debugger_requested)
+        self.assertEqual(requested, [False, True])
+        self.assertIsNone(s.gdb_port)
+        s.close()
+    def test_user_net_ports_per_instance(self):
+        s = fm_agent.create()
+        s.configuration.json_configs["FVP_MPS2_M3"]["user_net_ports"] = [80]
+        t = fm_agent.create()
+        t.configuration.json_configs["FVP_MPS2_M3"]["user_net_ports"] = [80]
+        with s, t:
+            s.setup_simulator("FVP_MPS2_M3","MPS2")
+            t.setup_simulator("FVP_MPS2_M3","MPS2")
+            self.assertNotEqual(s.net_ports[80].value, t.net_ports[80].value)
+            self.assertIn(f'fvp_mps2.hostbridge.userNetPorts={s.net_ports[80].value}=80', s.model_options)
+        self.assertEqual(s.net_ports, {})
+    def test_user_networking_disabled(self):
+        s = fm_agent.create()
+        s.configuration.json_configs["FVP_MPS2_M3"]["user_net_ports"] = [80]
+        s.configuration.json_configs["FVP_MPS2_M3"]["model_options"] = ["-C", "fvp_mps2.hostbridge.userNetworking=0"]
+        with s:
+            s.setup_simulator("FVP_MPS2_M3","MPS2")
+            self.assertEqual(s.net_ports, {})
+            self.assertFalse(any("userNetPorts" in option for option in s.model_options))
+    def test_setup_again_frees_ports(self):
+        s = fm_agent.create()
+        s.configuration.json_configs["FVP_MPS2_M3"]["user_net_ports"] = [80]
+        with s:
+            s.setup_simulator("FVP_MPS2_M3","MPS2")
+            telnet_port = s.telnet_port
+            s.setup_simulator("FVP_MPS2_M3","MPS2")
+            self.assertTrue(telnet_port.freed)
+            self.assertEqual(s._net_port_allocator.ports, {s.net_ports[80].value})
+    @unittest.skipUnless(fm_agent.fm_agent.fcntl, "requires fcntl")
+    def test_ports_reserved_across_processes(self):
+        with tempfile.TemporaryDirectory() as cache_dir, mock.patch.dict(os.environ, {"FM_AGENT_CACHE_DIR": cache_dir}):
+            other = subprocess.Popen([sys.executable, "-c", "import sys, fm_agent\n"
+                                      "port = fm_agent.fm_agent._PortAllocator(20000, 20010, lock_name=str).allocate()\n"
+                                      "print(port.value, flush=True)\n"
+                                      "sys.stdin.read()"],
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
+            try:
+                taken = int(other.stdout.readline())
+                port = fm_agent.fm_agent._PortAllocator(20000, 20010, lock_name=str).allocate()
+                self.assertNotEqual(port.value, taken)
+            finally:
+                other.communicate("")
+            self.assertEqual(fm_agent.fm_agent._PortAllocator(20000, 20010, lock_name=str).allocate().value, taken)
+    def test_ports_in_use_skipped(self):
+        with socket.socket() as server:
+            server.bind(('', 0))
+            server.listen(1)
+            busy = server.getsockname()[1]
+            port = fm_agent.fm_agent._PortAllocator(busy, busy + 2, bind=True).allocate()
+            self.assertEqual(port.value, busy + 1)
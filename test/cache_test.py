@@ -0,0 +1,40 @@
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from fm_agent.model_cache import ModelMetadataCache
+
+class TestModelMetadataCache(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.binary = os.path.join(self.tmpdir.name, "FVP_TEST")
+        with open(self.binary, "w") as f:
+            f.write("model")
+        self.cache = ModelMetadataCache(os.path.join(self.tmpdir.name, "cache.json"))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_roundtrip(self):
+        key = self.cache.key(self.binary, "MPS2.conf")
+        self.cache.set(key, "cpus", ["component.cpu0"])
+        self.assertEqual(ModelMetadataCache(self.cache.cache_file).get(key, "cpus"), ["component.cpu0"])
+
+    def test_key_changes_with_mtime(self):
+        key = self.cache.key(self.binary)
+        stat = os.stat(self.binary)
+        os.utime(self.binary, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertNotEqual(self.cache.key(self.binary), key)
+
+    def test_missing_binary(self):
+        self.assertIsNone(self.cache.key(os.path.join(self.tmpdir.name, "NOT_EXIST")))
+        self.assertIsNone(self.cache.get(None, "cpus"))
+
+    def test_unwritable_cache_dir(self):
+        # a file where the cache directory should be, as with HOME=/proc
+        cache_dir = os.path.join(self.binary, "cache")
+        with mock.patch.dict(os.environ, {"FM_AGENT_CACHE_DIR": cache_dir}):
+            cache = ModelMetadataCache()
+            key = cache.key(self.binary)
+            cache.set(key, "params", ["cpu.param"])
+            self.assertIsNone(cache.get(key, "params"))
@@ -17,4 +17,17 @@ class TestFastmodelConfig(TestCase):
         
     def test_get_all_configs(self):
         c=FastmodelConfig()
-        self.assertIsNotNone(c.get_all_configs())  
\ No newline at end of file
+        self.assertIsNotNone(c.get_all_configs())  
+    def test_agent_settings_default(self):
+        c=FastmodelConfig()
+        self.assertTrue(c.get_enable_iris("FVP_MPS2_M3"))
+        self.assertFalse(c.get_detect_exit("FVP_MPS2_M3"))
+        self.assertIsNone(c.get_record("FVP_MPS2_M3"))
+        self.assertIsNone(c.get_run_history("FVP_MPS2_M3"))
+
+    def test_agent_settings_common(self):
+        c=FastmodelConfig()
+        c.json_configs["COMMON"]["detect_exit"] = True
+        c.json_configs["FVP_MPS2_M3"]["detect_exit"] = False
+        self.assertTrue(c.get_detect_exit("FVP_MPS2_M0"))
+        self.assertFalse(c.get_detect_exit("FVP_MPS2_M3"))
@@ -0,0 +1,116 @@
+import os
+import sys
+import struct
+import tempfile
+from subprocess import Popen
+from unittest import TestCase, mock
+
+import fm_agent
+
+SYMBOL_TABLE = """
+   Num:    Value  Size Type    Bind   Vis      Ndx Name
+   310: 00001235    96 FUNC    GLOBAL DEFAULT    1 collect_coverage
+   311: 00001301    64 FUNC    GLOBAL DEFAULT    1 __gcov_close__ported
+   312: 20000100    12 OBJECT  GLOBAL DEFAULT    4 __gcov_var__ported
+""".split("\n")
+
+DUMP_PC = 0x133c
+EXIT_PC = 0x1290
+
+class _FakeCpu():
+    instName = "component.cpu0"
+
+    def __init__(self):
+        self.pc = 0
+        self.memory = {}
+        self.breakpoints = []
+
+    def add_bpt_prog(self, address):
+        self.breakpoints.append(address)
+
+    def read_register(self, name):
+        return self.pc
+
+    def read_memory(self, address, size=1, count=1):
+        for base, data in self.memory.items():
+            if base <= address and address + size * count <= base + len(data):
+                return bytearray(data[address - base:address - base + size * count])
+        raise ValueError("read outside of mapped memory")
+
+class _FakeModel():
+    """ stops at the next scripted (pc, memory) on every run, times out once the script is over """
+    def __init__(self, cpu, script):
+        self.cpu = cpu
+        self.script = list(script)
+        self.released = False
+
+    def run(self, timeout=None, blocking=True):
+        if not self.script:
+            raise Exception("timeout")
+        self.cpu.pc, memory = self.script.pop(0)
+        self.cpu.memory.update(memory)
+
+    def stop(self):
+        pass
+
+    def release(self, shutdown=False):
+        self.released = True
+
+class TestCodeCoverage(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.agent = fm_agent.create()
+        self.agent.config_name = "COVERAGE"
+        self.agent.image = os.path.join(self.tmpdir.name, "test.elf")
+        self.cpu = _FakeCpu()
+        self.agent.cpus = [self.cpu]
+        patches = [mock.patch("fm_agent.fm_agent.read_symbol", return_value=SYMBOL_TABLE),
+                   mock.patch("fm_agent.fm_agent.get_return_addrs",
+                              side_effect=lambda image, start, size: [EXIT_PC] if start == 0x1234 else [DUMP_PC]),
+                   mock.patch("fm_agent.fm_agent.remove_gcda"),
+                   mock.patch("fm_agent.fm_agent.lcov_collect")]
+        for patch in patches:
+            self.lcov_collect = patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.agent.model = None
+        self.agent.close()
+        self.tmpdir.cleanup()
+
+    def gcda(self, name, data):
+        filename = os.path.join(self.tmpdir.name, name).encode() + b'\0'
+        return (DUMP_PC, {0x20000100: struct.pack('<3I', 0x20001000, 0x20001000 + len(data), 0x20000200),
+                          0x20000200: filename, 0x20001000: data})
+
+    def run_coverage(self, script):
+        self.agent.model = _FakeModel(self.cpu, script)
+        self.assertTrue(self.agent._FastmodelAgent__resolve_coverage())
+        return self.agent._FastmodelAgent__CodeCoverage()
+
+    def test_dump_loop(self):
+        dumps = self.run_coverage([self.gcda("a.gcda", b'gcda-a'), self.gcda("b.gcda", b'gcda-bb'), (EXIT_PC, {})])
+        self.assertEqual([os.path.basename(name) for name, _ in dumps], ["a.gcda", "b.gcda"])
+        with open(os.path.join(self.tmpdir.name, "b.gcda"), "rb") as f:
+            self.assertEqual(f.read(), b'gcda-bb')
+        self.assertEqual(sorted(self.cpu.breakpoints), [EXIT_PC, DUMP_PC])
+        self.lcov_collect.assert_called_once_with("test.elf")
+
+    def test_missed_exit_is_an_error(self):
+        with self.assertRaises(fm_agent.SimulatorError):
+            self.run_coverage([self.gcda("a.gcda", b'gcda-a')])
+        self.assertEqual(len(self.agent.coverage_dumps), 1)
+        self.lcov_collect.assert_not_called()
+
+    def test_missing_readelf(self):
+        with mock.patch("fm_agent.fm_agent.read_symbol", side_effect=fm_agent.SimulatorError("no readelf")):
+            self.assertFalse(self.agent._FastmodelAgent__resolve_coverage())
+        self.assertIsNone(self.agent.coverage_breakpoints)
+
+    def test_shutdown_releases_model_on_error(self):
+        model = self.agent.model = _FakeModel(self.cpu, [])
+        self.agent.subprocess = Popen([sys.executable, '-c', 'pass'])
+        with self.assertRaises(fm_agent.SimulatorError):
+            self.agent.shutdown_simulator()
+        self.assertTrue(model.released)
+        self.assertIsNone(self.agent.model)
@@ -0,0 +1,70 @@
+import sys
+from subprocess import Popen
+from unittest import TestCase, mock
+
+import fm_agent
+from fm_agent.exit_monitor import ExitMonitor, semihosting_exit_code, SYS_EXIT, SYS_EXIT_EXTENDED
+
+class TestExitMonitor(TestCase):
+    def test_semihosting_exit_code(self):
+        memory = {0x100: 0x20026, 0x104: 3}
+        self.assertEqual(semihosting_exit_code(SYS_EXIT, 0x20026, memory.get), 0)
+        self.assertEqual(semihosting_exit_code(SYS_EXIT_EXTENDED, 0x100, memory.get), 3)
+        self.assertIsNone(semihosting_exit_code(0x05, 0x100, memory.get))
+
+    def test_future_resolves(self):
+        polls = iter([None, None, 7])
+        monitor = ExitMonitor(lambda: next(polls), interval=0.001).start()
+        self.assertEqual(monitor.exit_future.result(timeout=5), 7)
+        monitor.stop()
+        self.assertEqual(monitor.exit_future.result(), 7)
+
+    def test_stop_cancels(self):
+        monitor = ExitMonitor(lambda: None, interval=0.001).start()
+        monitor.stop()
+        self.assertTrue(monitor.exit_future.cancelled())
+
+class _ExitedCpu():
+    @property
+    def is_running(self):
+        raise ConnectionError("IRIS connection closed")
+
+class _BreakpointCpu():
+    def __init__(self):
+        self.breakpoints = []
+
+    def add_bpt_prog(self, address):
+        self.breakpoints.append(address)
+
+SYMBOL_TABLE = """
+   Num:    Value  Size Type    Bind   Vis      Ndx Name
+   120: 00002001    24 FUNC    GLOBAL DEFAULT    1 exit
+   121: 00002101     8 FUNC    GLOBAL DEFAULT    1 _exit
+""".split("\n")
+
+class TestIrisExitCode(TestCase):
+    def test_model_process_exit(self):
+        agent = fm_agent.create()
+        agent.subprocess = Popen([sys.executable, '-c', 'import sys; sys.exit(3)'])
+        # the model exits while the cpu is queried, as on a semihosting SYS_EXIT
+        self.assertEqual(agent._FastmodelAgent__iris_exit_code(_ExitedCpu()), 3)
+        # and once it is gone, IRIS is not queried at all
+        self.assertEqual(agent._FastmodelAgent__iris_exit_code(None), 3)
+        agent.close()
+
+    def exit_breakpoints(self, **patch):
+        agent = fm_agent.create(detect_exit=True)
+        agent.image = "test.elf"
+        agent.cpus = [_BreakpointCpu()]
+        with mock.patch("fm_agent.fm_agent.read_symbol", **patch):
+            agent._FastmodelAgent__set_exit_breakpoints()
+        agent.close()
+        return agent.cpus[0].breakpoints, agent.exit_addrs
+
+    def test_exit_breakpoint_after_stdio_flush(self):
+        self.assertEqual(self.exit_breakpoints(return_value=SYMBOL_TABLE), ([0x2100], {0x2100}))
+        self.assertEqual(self.exit_breakpoints(return_value=SYMBOL_TABLE[:-2]), ([0x2000], {0x2000}))
+
+    def test_exit_breakpoints_without_readelf(self):
+        error = fm_agent.SimulatorError("no arm-none-eabi-readelf")
+        self.assertEqual(self.exit_breakpoints(side_effect=error), ([], set()))
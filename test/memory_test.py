@@ -0,0 +1,54 @@
+import struct
+from unittest import TestCase
+
+from fm_agent.target_memory import TargetMemory, TargetStruct
+from fm_agent.utils import ByteToInt
+
+class _FakeTarget():
+    def __init__(self, base, data):
+        self.base = base
+        self.data = bytes(data)
+        self.reads = 0
+
+    def read_memory(self, address, size=1, count=1):
+        self.reads += 1
+        offset = address - self.base
+        if offset < 0 or offset + size * count > len(self.data):
+            raise ValueError("read outside of mapped memory")
+        return bytearray(self.data[offset:offset + size * count])
+
+class TestTargetMemory(TestCase):
+    def setUp(self):
+        payload = struct.pack('<3I', 0x1100, 0x1104, 0x1010) + bytes(4) + b'main.gcda\0'
+        payload += bytes(0x1100 - 0x1000 - len(payload)) + b'\x01\x02\x03\x04'
+        self.target = _FakeTarget(0x1000, payload)
+        self.memory = TargetMemory(self.target)
+
+    def test_byte_to_int(self):
+        self.assertEqual(ByteToInt(bytearray(b'\x78\x56\x34\x12')), 0x12345678)
+
+    def test_read_struct(self):
+        layout = TargetStruct('gcov_var', [('start', 'I'), ('end', 'I'), ('filename', 'I')])
+        value = self.memory.read_struct(0x1000, layout)
+        self.assertEqual(value.start, 0x1100)
+        self.assertEqual(value.end, 0x1104)
+        self.assertEqual(self.target.reads, 1)
+
+    def test_read_cstring(self):
+        self.assertEqual(self.memory.read_cstring(0x1010), "main.gcda")
+
+    def test_read_words(self):
+        self.assertEqual(self.memory.read_words(0x1000, 2), (0x1100, 0x1104))
+
+    def test_read_batch_merges(self):
+        views = self.memory.read_batch([(0x1008, 4), (0x1000, 4), (0x1100, 4)])
+        self.assertEqual(ByteToInt(views[0]), 0x1010)
+        self.assertEqual(ByteToInt(views[1]), 0x1100)
+        self.assertEqual(bytes(views[2]), b'\x01\x02\x03\x04')
+        self.assertEqual(self.target.reads, 2)
+    def test_read_cstring_end_of_region(self):
+        target = _FakeTarget(0x2000, bytes(0x38) + b'tail\0')
+        self.assertEqual(TargetMemory(target).read_cstring(0x2038), "tail")
+    def test_read_cstring_unaligned_fallback(self):
+        target = _FakeTarget(0x2000, b'abc\0')
+        self.assertEqual(TargetMemory(target).read_cstring(0x2001), "bc")
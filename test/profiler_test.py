@@ -0,0 +1,45 @@
+from unittest import TestCase
+
+from fm_agent.profiler import SymbolIndex, PCSampler, UNKNOWN_FUNCTION
+
+SYMBOL_TABLE = """
+   Num:    Value  Size Type    Bind   Vis      Ndx Name
+    24: 0002f45a     0 NOTYPE  LOCAL  DEFAULT    2 init_bss
+   310: 00001001    16 FUNC    GLOBAL DEFAULT    1 main
+   311: 00001011    32 FUNC    GLOBAL DEFAULT    1 busy_loop
+""".split("\n")
+
+class _FakeCpu():
+    instName = "cpu0"
+    def __init__(self, pcs, running=True):
+        self.pcs = iter(pcs)
+        self.is_running = running
+
+    def read_register(self, name):
+        return next(self.pcs)
+
+class TestProfiler(TestCase):
+    def test_lookup(self):
+        index = SymbolIndex(SYMBOL_TABLE)
+        self.assertEqual(index.lookup(0x1000), "main")
+        self.assertEqual(index.lookup(0x1010), "busy_loop")
+        self.assertEqual(index.lookup(0x1030), UNKNOWN_FUNCTION)
+        self.assertEqual(index.lookup(0x0ffe), UNKNOWN_FUNCTION)
+
+    def test_profiles(self):
+        sampler = PCSampler([_FakeCpu([0x1004, 0x1012, 0x1014])], SymbolIndex(SYMBOL_TABLE), rate=10000)
+        sampler.start()._thread.join(timeout=5)
+        self.assertEqual(sampler.collapsed_stacks(), "cpu0;busy_loop 2\ncpu0;main 1\n")
+        self.assertIn("66.67          2  busy_loop", sampler.flat_profile())
+
+    def test_resume_keeps_samples(self):
+        sampler = PCSampler([_FakeCpu([0x1004])], SymbolIndex(SYMBOL_TABLE), rate=10000)
+        sampler.start()._thread.join(timeout=5)
+        sampler.stop()
+        sampler.start([_FakeCpu([0x1012])])._thread.join(timeout=5)
+        self.assertEqual(sampler.collapsed_stacks(), "cpu0;busy_loop 1\ncpu0;main 1\n")
+
+    def test_halted_cpu_not_sampled(self):
+        sampler = PCSampler([_FakeCpu([0x1004]), _FakeCpu([0x1012], running=False)], SymbolIndex(SYMBOL_TABLE), rate=10000)
+        sampler.start()._thread.join(timeout=5)
+        self.assertEqual(sampler.collapsed_stacks(), "cpu0;main 1\n")
@@ -0,0 +1,106 @@
+import os
+import sys
+import stat
+import tempfile
+import unittest
+from unittest import TestCase
+
+import fm_agent
+from fm_agent.run_history import RunHistory
+from fm_agent.supervisor import ProcessSupervisor
+
+# terminal only model taking LAUNCH_TIME to start listening on its terminal
+FAKE_MODEL = """#!%s
+import sys, time, socket
+if '--list-params' in sys.argv:
+    sys.exit(0)
+time.sleep(%f)
+server = socket.socket()
+server.bind(('localhost', 0))
+server.listen(1)
+print('telnetterminal0: Listening for serial connection on port %%d' %% server.getsockname()[1], flush=True)
+connection = server.accept()
+time.sleep(60)
+"""
+
+LAUNCH_TIME = 0.5
+
+class TestRunHistory(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.history = RunHistory(os.path.join(self.tmpdir.name, "history.db"))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_estimate(self):
+        self.history.record("FVP_MPS2_M3", "MPS2", "a.elf", {"launch": 2, "load": 1, "run": 10, "shutdown": 1})
+        self.history.record("FVP_MPS2_M3", "MPS2", "a.elf", {"launch": 2, "run": 16})
+        self.assertEqual(self.history.estimate("FVP_MPS2_M3", "MPS2", "a.elf"), 16)
+        # unknown image falls back to the model and config
+        self.assertEqual(self.history.estimate("FVP_MPS2_M3", "MPS2", "b.elf"), 16)
+        self.assertIsNone(self.history.estimate("FVP_MPS2_M3", "COVERAGE", "a.elf"))
+
+    def test_schedule_longest_first(self):
+        durations = {"long.elf": 100, "mid.elf": 60, "short1.elf": 50, "short2.elf": 40}
+        for image, run in durations.items():
+            self.history.record("FVP_MPS2_M3", "MPS2", image, {"run": run})
+        jobs = [("FVP_MPS2_M3", "MPS2", image) for image in sorted(durations)]
+        shards, makespan = self.history.schedule(jobs, 2)
+        self.assertEqual(makespan, 140)
+        self.assertEqual([job[2] for job in shards[0]], ["long.elf", "short2.elf"])
+        self.assertEqual([job[2] for job in shards[1]], ["mid.elf", "short1.elf"])
+
+    def test_unwritable_path(self):
+        history = RunHistory(os.path.join(self.tmpdir.name, "file", "history.db"))
+        open(os.path.join(self.tmpdir.name, "file"), "w").close()
+        history.record("FVP_MPS2_M3", "MPS2", "a.elf", {"run": 1})
+        self.assertEqual(history.estimate("FVP_MPS2_M3", "MPS2", "a.elf", default=5), 5)
+
+@unittest.skipUnless(os.name == 'posix', "requires a posix host")
+class TestPhaseTimes(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        model = os.path.join(self.tmpdir.name, "FVP_FAKE")
+        with open(model, "w") as f:
+            f.write(FAKE_MODEL % (sys.executable, LAUNCH_TIME))
+        os.chmod(model, os.stat(model).st_mode | stat.S_IEXEC)
+        config = os.path.join(self.tmpdir.name, "FAKE.conf")
+        open(config, "w").close()
+        self.image = os.path.join(self.tmpdir.name, "test.elf")
+        open(self.image, "w").close()
+
+        self.agent = fm_agent.create(enable_iris=False)
+        self.agent._supervisor = ProcessSupervisor(lease_dir=self.tmpdir.name)
+        self.agent.configuration.json_configs["FVP_FAKE"] = {
+            "model_binary": model,
+            "terminal_component": "component.FVP_FAKE.telnetterminal0",
+            "configs": {"FAKE": config},
+        }
+        self.agent.setup_simulator("FVP_FAKE", "FAKE")
+
+    def tearDown(self):
+        self.agent.close()
+        self.tmpdir.cleanup()
+
+    def test_terminal_only_run_excludes_launch(self):
+        self.assertTrue(self.agent.start_simulator())
+        self.assertTrue(self.agent.load_simulator(self.image))
+        self.assertTrue(self.agent.run_simulator())
+        self.assertTrue(self.agent.reset_simulator())
+        self.agent.shutdown_simulator()
+        phases = self.agent.phase_times
+        self.assertGreaterEqual(phases["launch"], 2 * LAUNCH_TIME)
+        self.assertLess(phases["run"], LAUNCH_TIME)
+
+    def test_terminal_only_alive_until_exit(self):
+        self.assertTrue(self.agent.start_simulator())
+        self.assertTrue(self.agent.is_simulator_alive())
+        self.assertTrue(self.agent.load_simulator(self.image))
+        self.assertTrue(self.agent.run_simulator())
+        self.assertTrue(self.agent.is_simulator_alive())
+        self.agent.subprocess.kill()
+        self.agent.subprocess.wait()
+        self.assertFalse(self.agent.is_simulator_alive())
+        self.agent.shutdown_simulator()
+        self.assertFalse(self.agent.started)
@@ -0,0 +1,90 @@
+import os
+import socket
+import tempfile
+from unittest import TestCase
+
+import fm_agent
+from fm_agent.session import SessionRecorder
+
+class TestSession(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "session.jsonl.gz")
+        recorder = SessionRecorder(self.path)
+        recorder.event("setup", {"model": "FVP_MPS2_M3", "config": "MPS2"})
+        recorder.event("start")
+        recorder.event("load", "test.elf")
+        recorder.event("run")
+        recorder.traffic("rx", b"{{__sync;1}}\n")
+        recorder.traffic("tx", b"{{__sync;1}}\n")
+        recorder.traffic("rx", b"{{end;success}}\n")
+        recorder.event("shutdown")
+        recorder.close()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_replay(self):
+        with fm_agent.replay(self.path, speed=0) as sim:
+            self.assertEqual(sim.fastmodel_name, "FVP_MPS2_M3")
+            self.assertTrue(sim.start_simulator())
+            self.assertTrue(sim.load_simulator("test.elf"))
+            self.assertTrue(sim.run_simulator())
+            self.assertEqual(sim.read(), b"{{__sync;1}}\n")
+            self.assertTrue(sim.write("{{__sync;1}}\n"))
+            self.assertEqual(sim.read(bs=6), b"{{end;")
+            self.assertEqual(sim.read(), b"success}}\n")
+            self.assertEqual(sim.read(), b"")
+        self.assertFalse(sim.is_simulator_alive())
+
+    def test_replay_exit(self):
+        path = os.path.join(self.tmpdir.name, "exit.jsonl")
+        recorder = SessionRecorder(path)
+        for ev, data in [("start", None), ("run", None), ("rx", "{{end;failure}}\n"), ("exit", 1),
+                         ("reset", None), ("rx", "{{end;success}}\n"), ("exit", 0)]:
+            recorder.event(ev, data)
+        recorder.close()
+        codes = []
+        with fm_agent.replay(path, speed=0) as sim:
+            sim.add_exit_callback(codes.append)
+            self.assertTrue(sim.start_simulator())
+            self.assertIsNone(sim.exit_future)
+            self.assertTrue(sim.run_simulator())
+            self.assertEqual(sim.read(), b"{{end;failure}}\n")
+            self.assertEqual(sim.read(), b"")
+            self.assertEqual(sim.exit_future.result(timeout=0), 1)
+            self.assertTrue(sim.reset_simulator())
+            self.assertFalse(sim.exit_future.done())
+            sim.read()
+            sim.read()
+        self.assertEqual(codes, [1, 0])
+
+    def test_replay_interface(self):
+        with fm_agent.replay(self.path, speed=0) as sim:
+            self.assertIn("FVP_MPS2_M3", sim.list_avaliable_models())
+            self.assertTrue(sim.check_config_exist("MPS2.conf"))
+            self.assertFalse(sim.check_config_exist("THISFILENOTEXIST.conf"))
+        with self.assertRaises(TypeError):
+            fm_agent.replay(self.path, enable_iris=False)
+
+    def test_recording_complete_after_shutdown(self):
+        path = os.path.join(self.tmpdir.name, "agent.jsonl.gz")
+        agent = fm_agent.create(record=path)
+        agent.enable_iris = False
+        agent.started = True
+        agent.shutdown_simulator()
+        # readable without close(), the gzip trailer is written on shutdown
+        with fm_agent.replay(path, speed=0) as sim:
+            self.assertEqual([e["ev"] for e in sim.events], ["shutdown"])
+        agent.close()
+
+    def test_agent_read_stops_at_end(self):
+        # ReplayAgent.read above follows the same semantics
+        agent = fm_agent.create()
+        agent.socket, remote = socket.socketpair()
+        agent.socket.settimeout(agent.read_timeout)
+        remote.sendall(b"{{__sync;1}}\n{{end;")
+        self.assertEqual(agent.read(), b"{{__sync;1}}\n")
+        self.assertEqual(agent.read(), b"{{end;")
+        remote.close()
+        agent.close()
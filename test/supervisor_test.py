@@ -0,0 +1,61 @@
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import tempfile
+import unittest
+from subprocess import Popen
+from unittest import TestCase
+
+from fm_agent.supervisor import ProcessSupervisor
+
+@unittest.skipUnless(os.name == 'posix' and shutil.which('sleep'), "requires a posix host")
+class TestProcessSupervisor(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.supervisor = ProcessSupervisor(lease_dir=self.tmpdir.name, stop_timeout=0.5)
+        self.sleep = shutil.which('sleep')
+
+    def tearDown(self):
+        self.supervisor.stop_all()
+        self.tmpdir.cleanup()
+
+    def _exec_done(self, pid):
+        with open('/proc/%d/cmdline' % pid, 'rb') as cmdline:
+            return bool(cmdline.read())
+
+    def test_stop_releases_lease(self):
+        proc = Popen([self.sleep, '30'], **self.supervisor.popen_kwargs())
+        self.supervisor.register(proc, self.sleep, [5000])
+        self.assertEqual(os.listdir(self.tmpdir.name), ["%d.json" % proc.pid])
+        self.assertIsNotNone(self.supervisor.stop(proc))
+        self.assertEqual(os.listdir(self.tmpdir.name), [])
+
+    def test_reap_orphans(self):
+        dead_owner = Popen([sys.executable, '-c', 'pass'])
+        dead_owner.wait()
+        orphan = Popen([self.sleep, '30'], start_new_session=True)
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline and os.path.exists('/proc') and not self._exec_done(orphan.pid):
+            time.sleep(0.01)
+        with open(os.path.join(self.tmpdir.name, "%d.json" % orphan.pid), "w") as lease:
+            json.dump({'host': socket.gethostname(), 'pid': orphan.pid, 'owner': dead_owner.pid,
+                       'binary': self.sleep, 'ports': []}, lease)
+        # same pid on another host sharing the registry
+        with open(os.path.join(self.tmpdir.name, "other.json"), "w") as lease:
+            json.dump({'host': 'other-host', 'pid': orphan.pid, 'owner': dead_owner.pid,
+                       'binary': self.sleep, 'ports': []}, lease)
+
+        self.assertEqual(self.supervisor.reap_orphans(), [orphan.pid])
+        self.assertIsNotNone(orphan.wait(5))
+        self.assertEqual(os.listdir(self.tmpdir.name), ["other.json"])
+
+    def test_unwritable_lease_dir(self):
+        open(os.path.join(self.tmpdir.name, "file"), "w").close()
+        supervisor = ProcessSupervisor(lease_dir=os.path.join(self.tmpdir.name, "file", "leases"), stop_timeout=0.5)
+        proc = Popen([self.sleep, '30'], **supervisor.popen_kwargs())
+        supervisor.register(proc, self.sleep)
+        self.assertEqual(supervisor.reap_orphans(), [])
+        self.assertIsNotNone(supervisor.stop(proc))
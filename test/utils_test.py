@@ -0,0 +1,101 @@
+import sys
+import logging
+from unittest import TestCase
+
+from fm_agent.utils import get_symbol_addr, get_symbol_range, parse_return_addrs, RETURN_INSN
+from fm_agent.utils import launch_FVP_terminal, FMLogger, TrafficRing, printf_logger
+
+SYMBOL_TABLE = """
+   Num:    Value  Size Type    Bind   Vis      Ndx Name
+    24: 0002f45a     0 NOTYPE  LOCAL  DEFAULT    2 init_bss
+   310: 00001235    96 FUNC    GLOBAL DEFAULT    1 collect_coverage
+   311: 20000100    12 OBJECT  GLOBAL DEFAULT    4 __gcov_var__ported
+""".split("\n")
+
+class TestSymbols(TestCase):
+    def test_get_symbol_addr(self):
+        self.assertEqual(get_symbol_addr(SYMBOL_TABLE, "__gcov_var__ported"), "20000100")
+
+    def test_get_symbol_range_clears_thumb_bit(self):
+        self.assertEqual(get_symbol_range(SYMBOL_TABLE, "collect_coverage"), (0x1234, 96))
+        self.assertIsNone(get_symbol_range(SYMBOL_TABLE, "collect"))
+
+    def test_return_instructions(self):
+        self.assertTrue(RETURN_INSN.match("    1290:\tbd10      \tpop\t{r4, pc}"))
+        self.assertTrue(RETURN_INSN.match("    1294:\t4770      \tbx\tlr"))
+        self.assertFalse(RETURN_INSN.match("    1240:\tb510      \tpush\t{r4, lr}"))
+
+    def test_tail_call_exits(self):
+        disassembly = "\n".join(["    1240:\tb510      \tpush\t{r4, lr}",
+                                 "    1242:\td001      \tbeq.n\t1248 <collect_coverage+0x14>",
+                                 "    1244:\te7fd      \tb.n\t1242 <collect_coverage+0xe>",
+                                 "    1246:\tbd10      \tpop\t{r4, pc}",
+                                 "    1248:\te8bd 4010 \tldmia.w\tsp!, {r4, lr}",
+                                 "    124c:\tf000 b800 \tb.w\t2000 <lcov_write>"])
+        self.assertEqual(parse_return_addrs(disassembly, 0x1234, 96), [0x1246, 0x124c])
+
+class TestLaunchTerminal(TestCase):
+    def test_parse_terminal_port(self):
+        fake_model = ("import time;"
+                      "print('telnetterminal1: Listening for serial connection on port 5001');"
+                      "print('telnetterminal0: Listening for serial connection on port 5004', flush=True);"
+                      "time.sleep(30)")
+        proc, port, stdout = launch_FVP_terminal(sys.executable, model_options=['-c', fake_model], timeout=10)
+        proc.kill()
+        proc.wait()
+        self.assertEqual(port, 5004)
+        self.assertIn("telnetterminal1", stdout)
+
+    def test_command_line_logged(self):
+        logger = _RecordingLogger()
+        proc, port, stdout = launch_FVP_terminal(sys.executable, model_options=['-c', 'pass'], image='test.elf',
+                                                 timeout=1, logger=printf_logger(logger))
+        proc.wait()
+        self.assertEqual(port, 0)
+        self.assertEqual(len(logger.lines), 1)
+        self.assertIn("'-a', 'test.elf'", logger.lines[0])
+
+class _RecordingLogger():
+    """ htrun style logger, prn_* take one formatted text """
+    def __init__(self):
+        self.lines = []
+        self.prn_wrn = self.prn_inf = lambda text, timestamp=True: self.lines.append(text)
+
+class _ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+class TestLogging(TestCase):
+    def test_level_mapping(self):
+        logger = FMLogger('fm_agent_test')
+        with self.assertLogs('fm_agent_test', level='DEBUG') as logs:
+            logger.prn_err("lost %s", "connection")
+            logger.prn_wrn("retry")
+            logger.prn_rxd("data")
+        self.assertEqual([r.levelname for r in logs.records], ['ERROR', 'WARNING', 'DEBUG'])
+        self.assertEqual(logs.records[0].getMessage(), "[ERR] lost connection")
+
+    def test_traffic_ring_keeps_latest(self):
+        ring = TrafficRing(max_bytes=9)
+        ring.append('TXD', b'abc\n')
+        ring.append('RXD', b'12')
+        ring.append('RXD', b'3456\n')
+        self.assertEqual(ring.size, 9)
+        logger = _RecordingLogger()
+        ring.dump(printf_logger(logger))
+        self.assertEqual(logger.lines, ['[TXD] c', '[RXD] 123456'])
+        self.assertEqual(ring.size, 0)
+
+    def test_traffic_dump_at_default_level(self):
+        logger = FMLogger('fm_agent_dump_test')
+        handler = _ListHandler()
+        logger.logger.addHandler(handler)
+        ring = TrafficRing()
+        ring.append('RXD', b'>>> test failed\n')
+        ring.dump(logger)
+        logger.logger.removeHandler(handler)
+        self.assertEqual(handler.messages, ["[WRN] [RXD] >>> test failed"])
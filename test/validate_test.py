@@ -0,0 +1,72 @@
+import os
+import sys
+import stat
+import tempfile
+import unittest
+from unittest import TestCase
+
+import fm_agent
+from fm_agent.model_cache import ModelMetadataCache
+from fm_agent.utils import option_params
+
+FAKE_MODEL = """#!%s
+import sys
+if '--list-params' in sys.argv:
+    for name in ['fvp_mps2.telnetterminal0.start_port', 'fvp_mps2.telnetterminal0.mode',
+                 'fvp_mps2.telnetterminal1.quiet', 'cpu0.semihosting-enable']:
+        print("%%-50s # (int , init-time) default = '0'" %% (name + '=0'))
+"""
+
+@unittest.skipUnless(os.name == 'posix', "requires a posix host")
+class TestConfigValidation(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.model = os.path.join(self.tmpdir.name, "FVP_FAKE")
+        with open(self.model, "w") as f:
+            f.write(FAKE_MODEL % sys.executable)
+        os.chmod(self.model, os.stat(self.model).st_mode | stat.S_IEXEC)
+        self.config = os.path.join(self.tmpdir.name, "FAKE.conf")
+
+        self.agent = fm_agent.create()
+        self.agent.metadata_cache = ModelMetadataCache(os.path.join(self.tmpdir.name, "cache.json"))
+        self.agent.configuration.json_configs["FVP_FAKE"] = {
+            "model_binary": self.model,
+            "model_options": ["-C", "cpu0.semihosting-enable=1"],
+            "terminal_component": "component.FVP_FAKE.fvp_mps2.telnetterminal0",
+            "configs": {"MPS2": self.config},
+        }
+
+    def tearDown(self):
+        self.agent.close()
+        self.tmpdir.cleanup()
+
+    def write_config(self, text):
+        with open(self.config, "w") as f:
+            f.write(text)
+
+    def test_valid_config(self):
+        self.write_config("## comment\nfvp_mps2.telnetterminal0.mode=raw\n\nfvp_mps2.telnetterminal1.quiet=1\n")
+        self.agent.setup_simulator("FVP_FAKE", "MPS2")
+        self.assertIsNotNone(self.agent.metadata_cache.get(self.agent.metadata_cache.key(self.model), "params"))
+
+    def test_invalid_config(self):
+        self.write_config("fvp_mps2.telnetterminal0.mode=raw\nmps3_board.telnetterminal1.quiet=1\n")
+        with self.assertRaises(fm_agent.SimulatorError) as e:
+            self.agent.setup_simulator("FVP_FAKE", "MPS2")
+        self.assertIn("FAKE.conf:2", str(e.exception))
+        self.assertIn("did you mean 'fvp_mps2.telnetterminal1.quiet'", str(e.exception))
+
+    def test_plugin_params_skipped(self):
+        self.write_config("fvp_mps2.telnetterminal0.mode=raw\n")
+        self.agent.configuration.json_configs["FVP_FAKE"]["model_options"] += [
+            "--plugin", "/opt/plugins/TarmacTrace.so", "-C", "TRACE.TarmacTrace.trace-file=trace.log"]
+        self.agent.setup_simulator("FVP_FAKE", "MPS2")
+        self.assertEqual(option_params(["--plugin=GDBRemoteConnection.so", "-C", "REMOTE_CONNECTION.GDBRemoteConnection.port=1",
+                                        "-C", "cpu0.semihosting-enable=1"]), ["cpu0.semihosting-enable"])
+
+    def test_empty_param_list_not_cached(self):
+        with open(self.model, "w") as f:
+            f.write("#!%s\n" % sys.executable)
+        self.write_config("mps3_board.telnetterminal1.quiet=1\n")
+        self.agent.setup_simulator("FVP_FAKE", "MPS2")
+        self.assertIsNone(self.agent.metadata_cache.get(self.agent.metadata_cache.key(self.model), "params"))